@@ -1,17 +1,37 @@
 import os
 import asyncio
+import contextvars
+import cProfile
 import logging
 import datetime
+import functools
+import hashlib
+import heapq
+import io
+import itertools
 import json
+import pstats
 import random
+import signal
+import secrets
+import socket
+import sqlite3
+import sys
+import time
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import closing
 from datetime import timedelta
+from urllib.parse import urlparse
 import pytz # Importa a biblioteca pytz para lidar com fusos horários
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-from telegram.error import BadRequest, Forbidden
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent, ChatMember
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler, filters, ContextTypes
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 
 from flask import Flask
+from werkzeug.serving import make_server
 from threading import Thread
 
 # --- Configuração de Log ---
@@ -37,42 +57,728 @@ ADMIN_CHAT_ID = None # Será definido pelo comando /start pelo primeiro usuário
 # Para ver a lista completa de fusos horários válidos, pesquise por "List of tz database time zones"
 TIMEZONE = pytz.timezone('America/Sao_Paulo') # ALtere se sua região for diferente
 
+# --- Instrumentação (Profiling) ---
+# Opt-in com PROFILING_ATIVO=1: cada handler e job registrado é medido (tempo de parede e
+# chamadas à Bot API), e uma tarefa de fundo mede o atraso do event loop. /stats mostra os
+# percentis; /perfil <segundos> captura um cProfile e o envia ao ADMIN_CHAT_ID como documento.
+PROFILING_ATIVO = os.getenv('PROFILING_ATIVO', '').lower() in ('1', 'true', 'sim')
+PROFILING_AMOSTRAS = int(os.getenv('PROFILING_AMOSTRAS', 1000)) # Amostras guardadas por handler
+LAG_INTERVALO = 0.5 # Segundos entre medições do atraso do event loop
+PERFIL_MAX_SEGUNDOS = 600
+
+amostras_handlers = {} # nome -> deque de (duração em s, chamadas à API)
+chamadas_api_por_metodo = Counter() # Método da Bot API -> total de chamadas
+amostras_lag = deque(maxlen=PROFILING_AMOSTRAS) # Atraso do event loop, em segundos
+_chamadas_api_atuais = contextvars.ContextVar('chamadas_api_atuais', default=None)
+perfil_em_andamento = False
+# Tarefas de fundo (instrumentação e /atualizarshards), canceladas no encerramento. Não usam
+# application.create_task, cujas tarefas o application.stop() aguarda (o monitor de atraso nunca termina).
+tarefas_de_fundo = set()
+
+def _tarefa_de_fundo(coro) -> None:
+    tarefa = asyncio.create_task(coro)
+    tarefas_de_fundo.add(tarefa)
+    tarefa.add_done_callback(tarefas_de_fundo.discard)
+
+def instrumentar(funcao):
+    """Envolve um handler/job (ou função síncrona) registrando o tempo e as chamadas à API.
+
+    Sem PROFILING_ATIVO, retorna a própria função (custo zero).
+    """
+    if not PROFILING_ATIVO:
+        return funcao
+    amostras = amostras_handlers.setdefault(funcao.__name__, deque(maxlen=PROFILING_AMOSTRAS))
+
+    if asyncio.iscoroutinefunction(funcao):
+        @functools.wraps(funcao)
+        async def medir_async(*args, **kwargs):
+            contador = [0] # Compartilhado com as tarefas criadas pelo handler (contexto copiado)
+            token = _chamadas_api_atuais.set(contador)
+            inicio = time.perf_counter()
+            try:
+                return await funcao(*args, **kwargs)
+            finally:
+                amostras.append((time.perf_counter() - inicio, contador[0]))
+                _chamadas_api_atuais.reset(token)
+        return medir_async
+
+    @functools.wraps(funcao)
+    def medir(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return funcao(*args, **kwargs)
+        finally:
+            amostras.append((time.perf_counter() - inicio, 0))
+    return medir
+
+class RequestInstrumentado(HTTPXRequest):
+    """HTTPXRequest que conta as chamadas à Bot API por método e pelo handler em execução."""
+    async def do_request(self, url: str, *args, **kwargs):
+        chamadas_api_por_metodo[url.rsplit('/', 1)[-1]] += 1
+        contador = _chamadas_api_atuais.get()
+        if contador is not None:
+            contador[0] += 1
+        return await super().do_request(url, *args, **kwargs)
+
+def criar_request(**kwargs) -> HTTPXRequest:
+    return RequestInstrumentado(**kwargs) if PROFILING_ATIVO else HTTPXRequest(**kwargs)
+
+async def monitorar_lag_loop() -> None:
+    """Mede quanto o event loop atrasa para acordar de um sleep (handlers bloqueando o loop)."""
+    while True:
+        inicio = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVALO)
+        amostras_lag.append(max(0.0, time.perf_counter() - inicio - LAG_INTERVALO))
+
+async def iniciar_monitor_lag(context: ContextTypes.DEFAULT_TYPE) -> None:
+    if PROFILING_ATIVO:
+        _tarefa_de_fundo(monitorar_lag_loop())
+
+def _percentis(valores) -> tuple:
+    """Retorna (p50, p95, p99, máximo) dos valores (método nearest-rank)."""
+    ordenados = sorted(valores)
+    if not ordenados:
+        return (0.0, 0.0, 0.0, 0.0)
+    return tuple(ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))] for p in (0.5, 0.95, 0.99)) + (ordenados[-1],)
+
+def relatorio_stats() -> str:
+    linhas = ["📊 **Estatísticas (ms: p50 / p95 / p99 / máx):**"]
+    for nome, amostras in sorted(amostras_handlers.items(), key=lambda item: -sum(d for d, _ in item[1])):
+        if not amostras:
+            continue
+        p50, p95, p99, maximo = _percentis(d for d, _ in amostras)
+        api_media = sum(c for _, c in amostras) / len(amostras)
+        linhas.append(
+            f"`{nome}` ({len(amostras)}x): {p50 * 1000:.0f} / {p95 * 1000:.0f} / {p99 * 1000:.0f} / {maximo * 1000:.0f}"
+            f", {api_media:.1f} chamadas API"
+        )
+    if amostras_lag:
+        p50, p95, p99, maximo = _percentis(amostras_lag)
+        linhas.append(f"\n⏱ **Atraso do event loop:** {p50 * 1000:.1f} / {p95 * 1000:.1f} / {p99 * 1000:.1f} / {maximo * 1000:.1f}")
+    if chamadas_api_por_metodo:
+        linhas.append("\n📡 **Chamadas à Bot API:** " + ", ".join(f"{metodo}: {total}" for metodo, total in chamadas_api_por_metodo.most_common(10)))
+    return "\n".join(linhas)
+
+async def capturar_perfil(bot: Bot, segundos: int) -> None:
+    """Executa o cProfile por `segundos` e envia o resultado ao ADMIN_CHAT_ID."""
+    global perfil_em_andamento
+    perfil_em_andamento = True
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            await asyncio.sleep(segundos)
+        finally:
+            profiler.disable()
+
+        saida = io.StringIO()
+        pstats.Stats(profiler, stream=saida).sort_stats('cumulative').print_stats(100)
+        await bot.send_document(
+            chat_id=ADMIN_CHAT_ID,
+            document=io.BytesIO(saida.getvalue().encode()),
+            filename=f"perfil_{datetime.datetime.now(TIMEZONE):%Y%m%d_%H%M%S}.txt",
+            caption=f"Perfil (cProfile) dos últimos {segundos}s, ordenado por tempo cumulativo."
+        )
+        logger.info(f"Perfil de {segundos}s enviado ao admin.")
+    except Exception as e:
+        logger.error(f"Erro ao capturar/enviar o perfil: {e}")
+    finally:
+        perfil_em_andamento = False
+
+# --- Registro de Canais ---
+class Canal:
+    """Registro compacto de um canal/grupo cadastrado (sem __dict__ por instância)."""
+    __slots__ = ('nome', 'tipo', 'link', 'data_cadastro', 'bots', 'extras')
+
+    def __init__(self, nome: str, tipo: str, link: str, data_cadastro: int, bots: tuple = (), extras: dict | None = None):
+        self.nome = nome
+        self.tipo = sys.intern(tipo) if tipo else tipo # 'group', 'supergroup' e 'channel' compartilham o mesmo objeto
+        self.link = link
+        self.data_cadastro = data_cadastro # Epoch em segundos
+        self.bots = bots # Ids dos bots (shards) membros do chat
+        self.extras = extras # Campos desconhecidos do arquivo, preservados ao salvar
+
+    @classmethod
+    def do_json(cls, registro: dict) -> 'Canal':
+        """Cria o registro a partir do formato persistido (consome o dicionário recebido)."""
+        data_cadastro = registro.pop('data_cadastro', None)
+        return cls(
+            registro.pop('nome', None),
+            registro.pop('tipo', None),
+            registro.pop('link', None),
+            int(datetime.datetime.fromisoformat(data_cadastro).timestamp()) if data_cadastro else 0,
+            tuple(registro.pop('bots', ())),
+            registro or None
+        )
+
+    def para_json(self) -> dict:
+        """Converte para o formato persistido (data de cadastro em ISO no fuso horário)."""
+        registro = {
+            'nome': self.nome,
+            'tipo': self.tipo,
+            'link': self.link,
+            'data_cadastro': datetime.datetime.fromtimestamp(self.data_cadastro, TIMEZONE).isoformat() if self.data_cadastro else None,
+            'bots': list(self.bots)
+        }
+        if self.extras:
+            registro.update(self.extras)
+        return registro
+
+def normalizar_busca(texto: str) -> str:
+    """Minúsculas e sem acentos, para que 'Notícias' e 'noticias' se encontrem."""
+    decomposto = unicodedata.normalize('NFKD', texto.casefold())
+    return ''.join(c for c in decomposto if not unicodedata.combining(c))
+
+class IndiceBusca:
+    """Índice invertido de trigramas (e prefixos de palavras, para buscas de 1-2 caracteres)
+    sobre nome, id e link dos canais. Atualizado a cada cadastro/remoção, sem varrer o registro.
+    """
+    __slots__ = ('_textos', '_trigramas', '_prefixos')
+
+    def __init__(self):
+        self._textos = {} # chat_id -> texto normalizado pesquisável
+        self._trigramas = defaultdict(set) # trigrama -> chat_ids
+        self._prefixos = defaultdict(set) # prefixo de 1-2 caracteres de uma palavra -> chat_ids
+
+    @staticmethod
+    def _texto(chat_id: int, canal: Canal) -> str:
+        link = (canal.link or '').removeprefix('https://').removeprefix('http://').removeprefix('t.me/')
+        return normalizar_busca(f"{canal.nome or ''} {chat_id} {link}")
+
+    def _chaves(self, texto: str):
+        trigramas = {texto[i:i + 3] for i in range(len(texto) - 2)}
+        prefixos = {palavra[:n] for palavra in texto.split() for n in (1, 2)}
+        return trigramas, prefixos
+
+    def adicionar(self, chat_id: int, canal: Canal) -> None:
+        self.remover(chat_id)
+        texto = self._textos[chat_id] = self._texto(chat_id, canal)
+        trigramas, prefixos = self._chaves(texto)
+        for trigrama in trigramas:
+            self._trigramas[trigrama].add(chat_id)
+        for prefixo in prefixos:
+            self._prefixos[prefixo].add(chat_id)
+
+    def remover(self, chat_id: int) -> None:
+        texto = self._textos.pop(chat_id, None)
+        if texto is None:
+            return
+        trigramas, prefixos = self._chaves(texto)
+        for chave, postings in itertools.chain(((t, self._trigramas) for t in trigramas), ((p, self._prefixos) for p in prefixos)):
+            ids = postings[chave]
+            ids.discard(chat_id)
+            if not ids:
+                del postings[chave]
+
+    def buscar(self, consulta: str, limite: int) -> list:
+        """Retorna até `limite` chat_ids cujo nome, id ou link contém `consulta`, primeiro os
+        nomes que começam com ela, depois em ordem alfabética."""
+        consulta = normalizar_busca(consulta).strip()
+        if not consulta:
+            return []
+        if len(consulta) < 3:
+            encontrados = self._prefixos.get(consulta, ())
+        else:
+            # Interseção começando pelo trigrama mais raro; a verificação final elimina os
+            # falsos positivos (trigramas presentes, mas não contíguos)
+            postings = sorted((self._trigramas.get(consulta[i:i + 3], set()) for i in range(len(consulta) - 2)), key=len)
+            candidatos = set(postings[0])
+            for ids in postings[1:]:
+                if not candidatos:
+                    break
+                candidatos &= ids
+            encontrados = [chat_id for chat_id in candidatos if consulta in self._textos[chat_id]]
+
+        # O texto indexado começa pelo nome normalizado
+        return heapq.nsmallest(limite, encontrados, key=lambda chat_id: (not self._textos[chat_id].startswith(consulta), self._textos[chat_id]))
+
+CANAIS_POR_PAGINA = 25 # Canais por mensagem/página nas listagens
+
+class RegistroCanais:
+    """Canais/grupos cadastrados de um tenant: chat_id -> Canal, em ordem de cadastro.
+
+    Mantém também um índice posicional (reconstruído sob demanda após remoções) para
+    paginação estável sem copiar o registro inteiro, um índice de busca (criado na
+    primeira busca e depois atualizado a cada cadastro/remoção) e a lista de links da
+    divulgação já renderizada (descartada a cada cadastro/remoção).
+    """
+    __slots__ = ('_canais', '_ordem', '_indice', '_links')
+
+    def __init__(self):
+        self._canais = {}
+        self._ordem = [] # chat_ids por posição; None quando precisa ser reconstruído
+        self._indice = None # IndiceBusca, criado sob demanda
+        self._links = None # Lista de links renderizada; None quando precisa ser refeita
+
+    def __len__(self) -> int:
+        return len(self._canais)
+
+    def __contains__(self, chat_id) -> bool:
+        return chat_id in self._canais
+
+    def __getitem__(self, chat_id: int) -> Canal:
+        return self._canais[chat_id]
+
+    def __iter__(self):
+        return iter(self._canais)
+
+    def __delitem__(self, chat_id: int) -> None:
+        del self._canais[chat_id]
+        self._ordem = None
+        self._links = None
+        if self._indice is not None:
+            self._indice.remover(chat_id)
+
+    def get(self, chat_id: int, padrao=None) -> Canal | None:
+        return self._canais.get(chat_id, padrao)
+
+    def keys(self):
+        return self._canais.keys()
+
+    def values(self):
+        return self._canais.values()
+
+    def items(self):
+        return self._canais.items()
+
+    def adicionar(self, chat_id: int, nome: str, tipo: str, link: str, bots: tuple = (), data_cadastro: int | None = None) -> Canal:
+        """Cadastra (ou atualiza, mantendo a posição) um canal/grupo."""
+        canal = Canal(nome, tipo, link, int(time.time()) if data_cadastro is None else data_cadastro, tuple(bots))
+        if chat_id not in self._canais and self._ordem is not None:
+            self._ordem.append(chat_id)
+        self._canais[chat_id] = canal
+        self._links = None
+        if self._indice is not None:
+            self._indice.adicionar(chat_id, canal)
+        return canal
+
+    def links_mensagem(self) -> str:
+        """Lista de links da divulgação, renderizada uma vez por versão do registro."""
+        if self._links is None:
+            self._links = "\n\n" + "".join(
+                f"➡️ {canal.link or canal.nome or 'Canal/Grupo Desconhecido'}\n" for canal in self._canais.values()
+            )
+        return self._links
+
+    def pagina(self, inicio: int, tamanho: int) -> list:
+        """Retorna os pares (chat_id, Canal) das posições [inicio, inicio + tamanho)."""
+        if self._ordem is None:
+            self._ordem = list(self._canais)
+        return [(chat_id, self._canais[chat_id]) for chat_id in self._ordem[inicio:inicio + tamanho]]
+
+    def buscar(self, consulta: str, limite: int) -> list:
+        """Retorna até `limite` pares (chat_id, Canal) cujo nome, id ou link contém a consulta."""
+        if self._indice is None:
+            self._indice = IndiceBusca()
+            for chat_id, canal in self._canais.items():
+                self._indice.adicionar(chat_id, canal)
+        return [(chat_id, self._canais[chat_id]) for chat_id in self._indice.buscar(consulta, limite)]
+
+    @classmethod
+    def do_json(cls, registros: dict) -> 'RegistroCanais':
+        """Cria o registro a partir do formato persistido ({"chat_id": {...}})."""
+        registro = cls()
+        for chat_id, dados_canal in registros.items():
+            # Converte chaves de volta para int (chat_ids são strings para chaves de JSON)
+            registro._canais[int(chat_id)] = Canal.do_json(dados_canal)
+        registro._ordem = list(registro._canais)
+        return registro
+
+    def gravar_json(self, f) -> None:
+        """Grava o registro no formato persistido, um canal por vez, sem montar uma cópia completa."""
+        f.write('{')
+        separador = '\n'
+        for chat_id, canal in self._canais.items():
+            f.write(f'{separador}        "{chat_id}": {json.dumps(canal.para_json())}')
+            separador = ',\n'
+        f.write('\n    }' if self._canais else '}')
+
 # --- Funções de Persistência de Dados ---
+CABECALHO_PADRAO = "✨ **Confira essas listas de canais e grupos no Telegram!** ✨"
+
+# Modo multi-tenant: cada admin (chat privado que usa /start) tem seu próprio tenant, com
+# registro de canais, cabeçalho, agendamentos e limite de envio isolados. Os dados de cada
+# tenant ficam em TENANTS_DIR/<admin_chat_id>.json. Sem MULTI_TENANT, o único tenant é o
+# ADMIN_CHAT_ID e seus dados são o próprio bot_data (DATA_FILE).
+MULTI_TENANT = os.getenv('MULTI_TENANT', '').lower() in ('1', 'true', 'sim')
+TENANTS_DIR = os.getenv('TENANTS_DIR', 'tenants')
+# Se definido, apenas esses chat_ids podem criar um tenant (ids separados por vírgula)
+TENANTS_PERMITIDOS = {int(t) for t in os.getenv('TENANTS_PERMITIDOS', '').split(',') if t.strip()}
+
+tenants = {} # admin_chat_id -> dados do tenant (apenas no modo multi-tenant)
+
+def _dados_do_json(loaded_data: dict, dados: dict) -> dict:
+    """Preenche `dados` a partir do formato persistido."""
+    dados['canais_e_grupos'] = RegistroCanais.do_json(loaded_data.get('canais_e_grupos', {}))
+    # Converte chaves de volta para int se necessário (chat_ids são strings para chaves de JSON)
+    dados['agendamentos'] = {int(k): v for k, v in loaded_data.get('agendamentos', {}).items()}
+    dados['cabecalho_texto'] = loaded_data.get('cabecalho_texto', CABECALHO_PADRAO)
+    dados['cabecalho_media_id'] = loaded_data.get('cabecalho_media_id', None)
+    dados['cabecalho_media_type'] = loaded_data.get('cabecalho_media_type', None)
+    dados['cabecalho_media_shards'] = loaded_data.get('cabecalho_media_shards', {})
+    dados['cabecalho_media_origem'] = loaded_data.get('cabecalho_media_origem', None) # URL/arquivo do último upload
+    return dados
+
+def _gravar_json(caminho: str, dados: dict, **extras) -> None:
+    """Grava os dados de um tenant (mais os campos `extras`) no formato persistido."""
+    # Grava em um arquivo temporário e troca de forma atômica, para que um standby
+    # que assuma a liderança nunca leia um arquivo pela metade
+    tmp_file = f"{caminho}.tmp"
+    with open(tmp_file, 'w') as f:
+        # O registro de canais é gravado em streaming; os demais campos são pequenos.
+        # json.dumps converte as chaves int (chat_ids) de 'agendamentos' para string.
+        f.write('{\n    "canais_e_grupos": ')
+        dados['canais_e_grupos'].gravar_json(f)
+        for chave, valor in itertools.chain(dados.items(), extras.items()):
+            if chave != 'canais_e_grupos':
+                f.write(f',\n    {json.dumps(chave)}: ' + json.dumps(valor, indent=4).replace('\n', '\n    '))
+        f.write('\n}\n')
+    os.replace(tmp_file, caminho)
+
+def _arquivo_do_tenant(tenant_id: int) -> str:
+    return os.path.join(TENANTS_DIR, f"{tenant_id}.json")
+
 def load_data():
     global bot_data, ADMIN_CHAT_ID
     if os.path.exists(DATA_FILE):
         with open(DATA_FILE, 'r') as f:
             loaded_data = json.load(f)
-            # Converte chaves de volta para int se necessário (chat_ids são strings para chaves de JSON)
-            bot_data['canais_e_grupos'] = {int(k): v for k, v in loaded_data.get('canais_e_grupos', {}).items()}
-            bot_data['agendamentos'] = {int(k): v for k, v in loaded_data.get('agendamentos', {}).items()}
-            bot_data['cabecalho_texto'] = loaded_data.get('cabecalho_texto', "✨ **Confira essas listas de canais e grupos no Telegram!** ✨")
-            bot_data['cabecalho_media_id'] = loaded_data.get('cabecalho_media_id', None)
-            bot_data['cabecalho_media_type'] = loaded_data.get('cabecalho_media_type', None)
+            _dados_do_json(loaded_data, bot_data)
             ADMIN_CHAT_ID = loaded_data.get('ADMIN_CHAT_ID') # Carrega ADMIN_CHAT_ID persistente
             logger.info("Dados do bot carregados com sucesso.")
             if ADMIN_CHAT_ID:
                 logger.info(f"ADMIN_CHAT_ID carregado: {ADMIN_CHAT_ID}")
     else:
         # Inicializa com valores padrão se o arquivo não existir
-        bot_data.setdefault('canais_e_grupos', {})
-        bot_data.setdefault('agendamentos', {})
-        bot_data.setdefault('cabecalho_texto', "✨ **Confira essas listas de canais e grupos no Telegram!** ✨")
-        bot_data.setdefault('cabecalho_media_id', None)
-        bot_data.setdefault('cabecalho_media_type', None)
+        _dados_do_json({}, bot_data)
         logger.info("Arquivo de dados não encontrado. Iniciando com dados padrão.")
 
-def save_data():
-    # Converte chaves de int para string para salvar em JSON
-    data_to_save = bot_data.copy()
-    data_to_save['canais_e_grupos'] = {str(k): v for k, v in bot_data.get('canais_e_grupos', {}).items()}
-    data_to_save['agendamentos'] = {str(k): v for k, v in bot_data.get('agendamentos', {}).items()}
-    data_to_save['ADMIN_CHAT_ID'] = ADMIN_CHAT_ID # Salva o ADMIN_CHAT_ID global
+    if MULTI_TENANT:
+        tenants.clear()
+        os.makedirs(TENANTS_DIR, exist_ok=True)
+        for nome_arquivo in os.listdir(TENANTS_DIR):
+            if nome_arquivo.endswith('.json'):
+                with open(os.path.join(TENANTS_DIR, nome_arquivo), 'r') as f:
+                    tenants[int(nome_arquivo[:-len('.json')])] = _dados_do_json(json.load(f), {})
+        # Migração: os dados do modo de admin único viram o tenant do ADMIN_CHAT_ID
+        migrado = bool(ADMIN_CHAT_ID) and ADMIN_CHAT_ID not in tenants
+        if migrado:
+            tenants[ADMIN_CHAT_ID] = dict(bot_data)
+            save_data(ADMIN_CHAT_ID)
+        if ADMIN_CHAT_ID in tenants:
+            # No modo multi-tenant o DATA_FILE guarda apenas o ADMIN_CHAT_ID: os dados do admin ficam
+            # no arquivo do seu tenant, sem uma segunda cópia (desatualizada) em memória e no disco
+            _dados_do_json({}, bot_data)
+            if migrado:
+                save_data()
+                logger.info(f"Dados do {DATA_FILE} migrados para o tenant {ADMIN_CHAT_ID}.")
+        logger.info(f"Modo multi-tenant: {len(tenants)} tenants carregados de '{TENANTS_DIR}'.")
+
+@instrumentar
+def save_data(tenant_id: int | None = None, todos: bool = False):
+    """Grava os dados. No modo multi-tenant, com tenant_id grava apenas o arquivo desse tenant e,
+    sem ele, apenas o DATA_FILE; todos=True (encerramento) grava também todos os tenants."""
+    # Apenas o líder grava o arquivo, para que réplicas em standby não sobrescrevam os dados
+    if not IS_LEADER:
+        logger.warning("Instância não é a líder. Gravação de dados ignorada.")
+        return
+
+    if MULTI_TENANT and tenant_id is not None:
+        if tenant_id in tenants:
+            _gravar_json(_arquivo_do_tenant(tenant_id), tenants[tenant_id])
+            logger.info(f"Dados do tenant {tenant_id} salvos com sucesso.")
+        return
 
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data_to_save, f, indent=4)
+    _gravar_json(DATA_FILE, bot_data, ADMIN_CHAT_ID=ADMIN_CHAT_ID) # Salva o ADMIN_CHAT_ID global
+    if MULTI_TENANT and todos:
+        for outro_tenant_id, dados in tenants.items():
+            _gravar_json(_arquivo_do_tenant(outro_tenant_id), dados)
     logger.info("Dados do bot salvos com sucesso.")
 
+def todos_os_tenants() -> dict:
+    """Retorna {tenant_id: dados} de todos os tenants."""
+    if MULTI_TENANT:
+        return tenants
+    return {ADMIN_CHAT_ID: bot_data} if ADMIN_CHAT_ID else {}
+
+def obter_tenant(chat_id: int) -> dict | None:
+    """Retorna os dados do tenant administrado pelo chat, ou None se o chat não for admin."""
+    if MULTI_TENANT:
+        return tenants.get(chat_id)
+    return bot_data if ADMIN_CHAT_ID and chat_id == ADMIN_CHAT_ID else None
+
+def pode_criar_tenant(chat_id: int) -> bool:
+    return MULTI_TENANT and chat_id not in tenants and (not TENANTS_PERMITIDOS or chat_id in TENANTS_PERMITIDOS)
+
+def criar_tenant(chat_id: int) -> dict:
+    """Cria um tenant vazio para o admin `chat_id` (modo multi-tenant)."""
+    tenants[chat_id] = _dados_do_json({}, {})
+    save_data(chat_id)
+    logger.info(f"Tenant {chat_id} criado.")
+    return tenants[chat_id]
+
+# --- Funções de Eleição de Líder (Lease) ---
+# Várias réplicas do bot podem rodar ao mesmo tempo: apenas a que detém o lease
+# (guardado em um SQLite local compartilhado) faz polling, agenda jobs, envia as
+# divulgações e grava o DATA_FILE. As demais ficam em standby e assumem quando o
+# lease do líder expira (no máximo LEASE_TTL + LEASE_RENOVACAO segundos).
+LEASE_DB = os.getenv('LEASE_DB', 'bot_lease.db')
+LEASE_NOME = 'lider'
+LEASE_TTL = float(os.getenv('LEASE_TTL', 30)) # Segundos até o lease expirar sem renovação
+LEASE_RENOVACAO = LEASE_TTL / 3 # Intervalo de renovação (e de tentativa dos standbys)
+INSTANCE_ID = os.getenv('INSTANCE_ID', f"{socket.gethostname()}-{os.getpid()}")
+CHECKPOINT_INTERVALO = float(os.getenv('CHECKPOINT_INTERVALO', 2)) # Segundos entre gravações do progresso do envio
+
+IS_LEADER = False
+lease_expira_em = 0.0 # Validade local do lease, usada se o banco ficar indisponível
+
+def _lease_conn() -> sqlite3.Connection:
+    """Abre uma conexão com o banco de lease, criando as tabelas se necessário."""
+    conn = sqlite3.connect(LEASE_DB, timeout=LEASE_RENOVACAO, isolation_level=None)
+    conn.execute("CREATE TABLE IF NOT EXISTS lease (nome TEXT PRIMARY KEY, dono TEXT NOT NULL, expira REAL NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS checkpoint (nome TEXT PRIMARY KEY, dados TEXT NOT NULL, atualizado REAL NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS checkpoint_eventos (id INTEGER PRIMARY KEY AUTOINCREMENT, dados TEXT NOT NULL)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS agendamentos_disparados "
+        "(tenant_id INTEGER NOT NULL, chave INTEGER NOT NULL, horario TEXT NOT NULL, quando REAL NOT NULL, "
+        "PRIMARY KEY (tenant_id, chave, horario))"
+    )
+    return conn
+
+def tentar_adquirir_lideranca() -> bool:
+    """Adquire ou renova o lease de líder. Retorna True se esta instância for a líder."""
+    global IS_LEADER, lease_expira_em
+    agora = time.time()
+    try:
+        with closing(_lease_conn()) as conn:
+            # BEGIN IMMEDIATE trava o banco para escrita: só uma réplica decide por vez
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT dono, expira FROM lease WHERE nome = ?", (LEASE_NOME,)).fetchone()
+            if row is None or row[0] == INSTANCE_ID or row[1] < agora:
+                conn.execute(
+                    "INSERT OR REPLACE INTO lease (nome, dono, expira) VALUES (?, ?, ?)",
+                    (LEASE_NOME, INSTANCE_ID, agora + LEASE_TTL)
+                )
+                conn.execute("COMMIT")
+                if row is not None and row[0] != INSTANCE_ID:
+                    logger.info(f"Lease assumido de '{row[0]}' (expirado em {row[1]:.0f}).")
+                lease_expira_em = agora + LEASE_TTL
+                IS_LEADER = True
+            else:
+                conn.execute("ROLLBACK")
+                IS_LEADER = False
+    except sqlite3.Error as e:
+        # Sem acesso ao banco, o líder só se mantém enquanto o lease que já tem for válido
+        logger.error(f"Erro ao acessar o banco de lease '{LEASE_DB}': {e}")
+        IS_LEADER = IS_LEADER and agora < lease_expira_em
+    return IS_LEADER
+
+def liberar_lideranca() -> None:
+    """Libera o lease para que um standby assuma imediatamente."""
+    global IS_LEADER
+    if not IS_LEADER:
+        return
+    try:
+        with closing(_lease_conn()) as conn:
+            conn.execute("DELETE FROM lease WHERE nome = ? AND dono = ?", (LEASE_NOME, INSTANCE_ID))
+        logger.info("Lease de líder liberado.")
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao liberar o lease: {e}")
+    IS_LEADER = False
+
+async def aguardar_lideranca() -> None:
+    """Bloqueia (em standby) até esta instância se tornar a líder."""
+    logger.info(f"Instância '{INSTANCE_ID}' aguardando liderança (lease em '{LEASE_DB}').")
+    while not tentar_adquirir_lideranca():
+        await asyncio.sleep(LEASE_RENOVACAO)
+    logger.info(f"Instância '{INSTANCE_ID}' é a líder.")
+
+async def renovar_lideranca(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job periódico que renova o lease. Se a liderança for perdida, para de agendar e encerra o polling."""
+    if tentar_adquirir_lideranca():
+        return
+    logger.critical("Liderança perdida para outra instância. Removendo jobs e encerrando o polling.")
+    parar_agendador()
+    for job in context.job_queue.get_jobs_by_name("daily_post_job"):
+        job.schedule_removal()
+    sinal_encerramento.set() # main() conduz o encerramento
+
+# O checkpoint de um envio é um retrato gravado uma única vez no início (chats pendentes,
+# resultados acumulados e tenants com relatório) mais um log de eventos acrescentado durante o
+# envio, apenas com os chats processados desde a última gravação. Cada gravação custa O(novos
+# eventos), e não O(chats pendentes). Evento: [tenant_id, chat_id, tipo, detalhe, bot_id], com
+# tipo 's' (sucesso), 'f' (falha), 'c' (remover o chat) ou 'b' (remover o bot bot_id do chat).
+
+def resultado_vazio() -> dict:
+    return {
+        'sucessos': 0,
+        'falhas': 0,
+        'falhas_detalhes': [],
+        'canais_para_remover': [],
+        'bots_para_remover': [] # Pares [chat_id, bot_id]
+    }
+
+def aplicar_evento(resultados: dict, evento: list) -> None:
+    """Acumula o resultado do envio para um chat em resultados[tenant_id]."""
+    tenant_id, chat_id_int, tipo, detalhe, bot_id = evento
+    r = resultados.setdefault(tenant_id, resultado_vazio())
+    if tipo == 's':
+        r['sucessos'] += 1
+        return
+    r['falhas'] += 1
+    r['falhas_detalhes'].append(detalhe)
+    if tipo == 'c':
+        r['canais_para_remover'].append(chat_id_int)
+    elif tipo == 'b':
+        r['bots_para_remover'].append([chat_id_int, bot_id])
+
+def salvar_checkpoint(estado: dict) -> None:
+    """Grava o retrato do envio em andamento (e descarta o log de eventos anterior)."""
+    if not IS_LEADER:
+        return
+    try:
+        with closing(_lease_conn()) as conn:
+            conn.execute("BEGIN")
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoint (nome, dados, atualizado) VALUES (?, ?, ?)",
+                ('envio', json.dumps(estado), time.time())
+            )
+            conn.execute("DELETE FROM checkpoint_eventos")
+            conn.execute("COMMIT")
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao gravar checkpoint do envio: {e}")
+
+def registrar_eventos_checkpoint(eventos: list) -> None:
+    """Acrescenta ao checkpoint os chats processados desde a última gravação."""
+    if not IS_LEADER or not eventos:
+        return
+    try:
+        with closing(_lease_conn()) as conn:
+            conn.execute("INSERT INTO checkpoint_eventos (dados) VALUES (?)", (json.dumps(eventos),))
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao gravar o progresso do envio: {e}")
+
+def carregar_checkpoint() -> dict | None:
+    """Retorna o progresso de um envio interrompido (retrato com o log de eventos aplicado), se houver."""
+    try:
+        with closing(_lease_conn()) as conn:
+            row = conn.execute("SELECT dados FROM checkpoint WHERE nome = ?", ('envio',)).fetchone()
+            lotes_eventos = [dados for (dados,) in conn.execute("SELECT dados FROM checkpoint_eventos ORDER BY id")] if row else []
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao ler checkpoint do envio: {e}")
+        return None
+    if not row:
+        return None
+    estado = json.loads(row[0])
+    resultados = {int(t): r for t, r in estado['resultados'].items()}
+    processados = set()
+    for dados in lotes_eventos:
+        for evento in json.loads(dados):
+            aplicar_evento(resultados, evento)
+            processados.add((evento[0], evento[1]))
+    estado['pendentes'] = [item for item in estado['pendentes'] if tuple(item) not in processados]
+    estado['resultados'] = resultados
+    return estado
+
+def limpar_checkpoint() -> None:
+    """Remove o checkpoint após o término do envio."""
+    if not IS_LEADER:
+        return
+    try:
+        with closing(_lease_conn()) as conn:
+            conn.execute("DELETE FROM checkpoint WHERE nome = ?", ('envio',))
+            conn.execute("DELETE FROM checkpoint_eventos")
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao limpar checkpoint do envio: {e}")
+
+def registrar_disparos(disparos: list) -> None:
+    """Grava o último disparo de cada (tenant_id, chave, horario), para recuperar horários perdidos em uma troca de líder."""
+    if not IS_LEADER or not disparos:
+        return
+    try:
+        with closing(_lease_conn()) as conn:
+            conn.executemany("INSERT OR REPLACE INTO agendamentos_disparados (tenant_id, chave, horario, quando) VALUES (?, ?, ?, ?)", disparos)
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao gravar os disparos do agendador: {e}")
+
+def carregar_disparos() -> dict:
+    """Retorna {(tenant_id, chave, horario): timestamp do último disparo}."""
+    try:
+        with closing(_lease_conn()) as conn:
+            return {(t, c, h): quando for t, c, h, quando in conn.execute("SELECT tenant_id, chave, horario, quando FROM agendamentos_disparados")}
+    except sqlite3.Error as e:
+        logger.error(f"Erro ao ler os disparos do agendador: {e}")
+        return {}
+
+class ProgressoEnvio:
+    """Envio em andamento compartilhado entre os shards: as filas de cada shard, os resultados
+    acumulados e a gravação no checkpoint (no máximo a cada CHECKPOINT_INTERVALO segundos, apenas
+    os eventos novos). Lotes que vencem durante o envio entram nas filas (ver incluir)."""
+    __slots__ = ('resultados', 'pendentes', 'relatorios', 'mensagens', 'tenants_alterados', 'shards', 'bot_principal',
+                 'filas', 'trabalhadores', 'enviados', 'proximo_por_tenant', 'aceitando', '_eventos', '_ultima_gravacao')
+
+    def __init__(self, resultados: dict, itens: list, relatorios: set, mensagens: dict):
+        self.resultados = resultados
+        self.pendentes = dict.fromkeys(itens) # (tenant_id, chat_id) ainda não processados, na ordem de inclusão
+        self.relatorios = relatorios
+        self.mensagens = mensagens # tenant_id -> divulgação montada
+        self.tenants_alterados = set() # Tenants cujos dados mudaram durante o envio (ex: file_id de um shard)
+        self.shards = []
+        self.bot_principal = None
+        self.filas = {} # bot_id -> FilaShard
+        self.trabalhadores = {} # bot_id -> tarefa que esvazia a fila do shard
+        self.enviados = Counter() # bot_id -> chats enviados
+        self.proximo_por_tenant = {} # Limite de envio de cada tenant, compartilhado entre os shards
+        self.aceitando = True # False quando as filas esvaziaram e o envio está finalizando
+        self._eventos = []
+        self._ultima_gravacao = time.monotonic()
+
+    def registrar(self, tenant_id: int, chat_id_int: int, tipo: str, detalhe: str | None = None, bot_id: int | None = None) -> None:
+        evento = [tenant_id, chat_id_int, tipo, detalhe, bot_id]
+        aplicar_evento(self.resultados, evento)
+        self.pendentes.pop((tenant_id, chat_id_int), None)
+        self._eventos.append(evento)
+        if time.monotonic() - self._ultima_gravacao >= CHECKPOINT_INTERVALO:
+            self.gravar()
+
+    def gravar(self) -> None:
+        registrar_eventos_checkpoint(self._eventos)
+        self._eventos = []
+        self._ultima_gravacao = time.monotonic()
+
+    def gravar_retrato(self) -> None:
+        """Regrava o retrato completo (no início e quando um lote é incluído, não a cada chat)."""
+        salvar_checkpoint({
+            'pendentes': [list(item) for item in self.pendentes],
+            'resultados': self.resultados,
+            'relatorio': list(self.relatorios)
+        })
+        self._eventos = [] # Já aplicados nos resultados do retrato
+        self._ultima_gravacao = time.monotonic()
+
+    def incluir(self, itens: list) -> None:
+        """Distribui os pares (tenant_id, chat_id) entre as filas dos shards e põe os shards ociosos para enviar."""
+        self.pendentes.update(dict.fromkeys(itens))
+        if not self.shards:
+            return # Envio ainda na pré-verificação: os pendentes são distribuídos quando ela terminar
+        particionar_chats(itens, self.shards, self.filas)
+        for shard_bot in self.shards:
+            if self.filas[shard_bot.id] and shard_bot.id not in self.trabalhadores:
+                self.trabalhadores[shard_bot.id] = asyncio.create_task(self._trabalhar(shard_bot))
+
+    async def _trabalhar(self, shard_bot) -> None:
+        try:
+            bot_id, enviados = await _enviar_shard(shard_bot, self.filas[shard_bot.id], self)
+            self.enviados[bot_id] += enviados
+        finally:
+            del self.trabalhadores[shard_bot.id]
+
+    async def aguardar(self) -> None:
+        """Aguarda as filas esvaziarem (inclusive lotes incluídos no meio do envio) e fecha o envio."""
+        while self.trabalhadores:
+            await asyncio.gather(*self.trabalhadores.values())
+        self.aceitando = False # Sem await depois do último shard: nenhum lote fica para trás
+
 # --- Funções do Flask para Keep-Alive ---
 app = Flask(__name__)
 
@@ -81,180 +787,904 @@ def hello_world():
     """Endpoint simples para o Render verificar se a aplicação está viva."""
     return 'Bot is alive!'
 
+servidor_flask = None # Servidor WSGI do keep-alive (parado no encerramento)
+
 def run_flask():
     """Inicia o servidor Flask."""
-    port = int(os.environ.get('PORT', 8080))
-    # Desativa o reloader e debug para produção
-    app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
+    servidor_flask.serve_forever()
 
 def keep_alive():
     """Inicia o servidor Flask em uma thread separada."""
-    t = Thread(target=run_flask)
+    global servidor_flask
+    port = int(os.environ.get('PORT', 8080))
+    # make_server em vez de app.run, para que o servidor possa ser parado no encerramento
+    try:
+        servidor_flask = make_server('0.0.0.0', port, app, threaded=True)
+    except OSError as e:
+        # Ex: outra réplica no mesmo host já usa a porta. O bot segue sem o keep-alive
+        # (defina um PORT por instância para que cada réplica tenha o seu)
+        logger.error(f"Não foi possível iniciar o servidor Flask de Keep-Alive na porta {port}: {e}. Seguindo sem ele.")
+        return
+    t = Thread(target=run_flask, daemon=True) # Daemon: nunca impede o processo de terminar
     t.start()
-    logger.info(f"Servidor Flask de Keep-Alive iniciado na porta {os.environ.get('PORT', 8080)}.")
-
-
-# --- Funções de Agendamento ---
-async def send_daily_posts(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Envia as publicações agendadas para todos os canais/grupos cadastrados."""
-    logger.info("Iniciando o envio de posts diários.")
-    canais_cadastrados = list(bot_data.get('canais_e_grupos', {}).keys())
-    random.shuffle(canais_cadastrados) # Opcional: embaralhar a ordem
-    
-    if not canais_cadastrados:
-        logger.info("Nenhum canal ou grupo cadastrado para envio.")
-        if ADMIN_CHAT_ID:
+    logger.info(f"Servidor Flask de Keep-Alive iniciado na porta {port}.")
+
+def parar_flask() -> None:
+    """Para o servidor do keep-alive (bloqueia até o loop do servidor terminar)."""
+    if servidor_flask is not None:
+        servidor_flask.shutdown()
+        servidor_flask.server_close()
+        logger.info("Servidor Flask de Keep-Alive parado.")
+
+
+# --- Funções de Shards (Vários Tokens) ---
+# Um único token limita a vazão global do envio. Com BOT_TOKENS_EXTRAS (tokens separados
+# por vírgula), cada chat é atribuído a um dos bots que são membros dele, e cada bot
+# (shard) envia em paralelo com seu próprio pool de conexões e limite de mensagens/s.
+BOT_TOKENS_EXTRAS = [t.strip() for t in os.getenv("BOT_TOKENS_EXTRAS", "").split(',') if t.strip()]
+SHARD_MSGS_POR_SEGUNDO = float(os.getenv('SHARD_MSGS_POR_SEGUNDO', 25)) # Limite de envio de cada bot
+SHARD_POOL_CONEXOES = int(os.getenv('SHARD_POOL_CONEXOES', 8))
+TENANT_MSGS_POR_SEGUNDO = float(os.getenv('TENANT_MSGS_POR_SEGUNDO', 0)) # Limite por tenant (0 = sem limite)
+
+shard_bots_extras = [] # Instâncias de Bot dos tokens extras (inicializadas sob demanda)
+atualizacoes_shards = set() # Tenants com um /atualizarshards em andamento
+
+async def obter_shards(context: ContextTypes.DEFAULT_TYPE) -> list:
+    """Retorna o bot principal seguido dos bots extras, inicializando-os na primeira chamada."""
+    if BOT_TOKENS_EXTRAS and not shard_bots_extras:
+        for token in BOT_TOKENS_EXTRAS:
+            shard_bot = Bot(token, request=criar_request(connection_pool_size=SHARD_POOL_CONEXOES))
             try:
-                await context.bot.send_message(
-                    chat_id=ADMIN_CHAT_ID,
-                    text="⚠️ Não há canais/grupos cadastrados para o envio agendado. ⚠️",
-                    parse_mode='Markdown'
-                )
+                await shard_bot.initialize()
+                shard_bots_extras.append(shard_bot)
+                logger.info(f"Shard inicializado: bot {shard_bot.id} (@{shard_bot.username}).")
             except Exception as e:
-                logger.error(f"Erro ao enviar mensagem de aviso ao admin: {e}")
-        return
-
-    cabecalho = bot_data.get('cabecalho_texto', "✨ **Confira essas listas de canais e grupos no Telegram!** ✨")
-    media_id = bot_data.get('cabecalho_media_id')
-    media_type = bot_data.get('cabecalho_media_type')
+                logger.error(f"Erro ao inicializar bot extra (token terminado em ...{token[-4:]}): {e}")
+    return [context.bot] + shard_bots_extras
 
-    # Cria a lista de links
-    links_mensagem = "\n\n"
-    for chat_id_int, info in bot_data['canais_e_grupos'].items():
-        links_mensagem += f"➡️ {info.get('link', info.get('nome', 'Canal/Grupo Desconhecido'))}\n"
-    
-    # Monta a mensagem completa
-    full_message = f"{cabecalho}{links_mensagem}"
-
-    sucessos = 0
-    falhas = 0
-    falhas_detalhes = []
-    canais_para_remover = []
+async def encerrar_shards() -> None:
+    """Fecha as conexões dos bots extras."""
+    for shard_bot in shard_bots_extras:
+        try:
+            await shard_bot.shutdown()
+        except Exception as e:
+            logger.error(f"Erro ao encerrar o bot extra {shard_bot.id}: {e}")
+    shard_bots_extras.clear()
+
+async def detectar_bots_membros(chat_id: int, context: ContextTypes.DEFAULT_TYPE, atuais: tuple = ()) -> list:
+    """Retorna os ids dos bots (shards) que são membros do chat.
+
+    Só o status do get_chat_member ou um Forbidden/BadRequest indicam que o bot não é membro.
+    Em outros erros (limite do Telegram persistente, rede), mantém o que já se sabia (`atuais`),
+    para que uma falha transitória não tire um bot de um chat que ele ainda alcança.
+    """
+    membros = []
+    for shard_bot in await obter_shards(context):
+        for tentativa in range(2):
+            try:
+                status = await shard_bot.get_chat_member(chat_id, shard_bot.id)
+                if status.status in (ChatMember.ADMINISTRATOR, ChatMember.OWNER, ChatMember.MEMBER):
+                    membros.append(shard_bot.id)
+            except (Forbidden, BadRequest) as e:
+                logger.debug(f"Bot {shard_bot.id} não é membro do chat {chat_id}: {e}")
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                if tentativa == 0:
+                    logger.warning(f"Bot {shard_bot.id} limitado pelo Telegram ao verificar o chat {chat_id}. Aguardando {retry_after}s.")
+                    await asyncio.sleep(retry_after)
+                    continue
+                if shard_bot.id in atuais:
+                    membros.append(shard_bot.id)
+            except Exception as e:
+                logger.warning(f"Não foi possível verificar o bot {shard_bot.id} no chat {chat_id} (mantido como estava): {e}")
+                if shard_bot.id in atuais:
+                    membros.append(shard_bot.id)
+            break
+    return membros
+
+class FilaShard:
+    """Fila de envio de um shard. Os tenants são atendidos em rodízio (t1, t2, t3, t1, t2, t3...),
+    inclusive os que entram com o envio em andamento, para que nenhum tenant monopolize o shard."""
+    __slots__ = ('_por_tenant', '_rodizio', '_tamanho')
+
+    def __init__(self):
+        self._por_tenant = {} # tenant_id -> deque de chats
+        self._rodizio = deque() # Tenants com chats na fila, na ordem em que serão atendidos
+        self._tamanho = 0
+
+    def __len__(self) -> int:
+        return self._tamanho
+
+    def incluir(self, tenant_id: int, chat_id_int: int) -> None:
+        fila = self._por_tenant.get(tenant_id)
+        if fila is None:
+            fila = self._por_tenant[tenant_id] = deque()
+            self._rodizio.append(tenant_id)
+        fila.append(chat_id_int)
+        self._tamanho += 1
+
+    def proximo(self) -> tuple:
+        """Retira o próximo par (tenant_id, chat_id) do rodízio."""
+        tenant_id = self._rodizio.popleft()
+        fila = self._por_tenant[tenant_id]
+        chat_id_int = fila.popleft()
+        if fila:
+            self._rodizio.append(tenant_id)
+        else:
+            del self._por_tenant[tenant_id]
+        self._tamanho -= 1
+        return tenant_id, chat_id_int
+
+def particionar_chats(itens: list, shards: list, filas: dict | None = None) -> dict:
+    """Distribui os pares (tenant_id, chat_id) entre as filas dos shards (bot_id -> FilaShard).
+
+    Cada chat vai para o bot membro com a menor fila; `filas` permite incluir chats nas
+    filas de um envio em andamento.
+    """
+    filas = {} if filas is None else filas
+    for shard_bot in shards:
+        filas.setdefault(shard_bot.id, FilaShard())
+    principal_id = shards[0].id
+    todos = todos_os_tenants()
+    for tenant_id, chat_id_int in itens:
+        canal = todos[tenant_id]['canais_e_grupos'].get(chat_id_int)
+        # Chats cadastrados antes dos shards não têm a lista de bots: usam o bot principal
+        candidatos = [b for b in (canal.bots if canal else ()) if b in filas] or [principal_id]
+        filas[min(candidatos, key=lambda b: len(filas[b]))].incluir(tenant_id, chat_id_int)
+    return filas
+
+def _file_id_da_mensagem(mensagem, media_type: str) -> str | None:
+    """Extrai o file_id da mídia de uma mensagem enviada."""
+    if media_type == 'photo' and mensagem.photo:
+        return mensagem.photo[-1].file_id
+    if media_type == 'video' and mensagem.video:
+        return mensagem.video.file_id
+    if media_type == 'animation' and mensagem.animation:
+        return mensagem.animation.file_id
+    return None
+
+async def _enviar_para_chat(shard_bot, chat_id_int: int, full_message: str, media, media_type: str | None, **extras):
+    """Envia a divulgação para um chat com o bot do shard e retorna a mensagem enviada."""
+    if media and media_type:
+        if media_type == 'photo':
+            return await shard_bot.send_photo(chat_id=chat_id_int, photo=media, caption=full_message, parse_mode='Markdown', **extras)
+        elif media_type == 'video':
+            return await shard_bot.send_video(chat_id=chat_id_int, video=media, caption=full_message, parse_mode='Markdown', **extras)
+        elif media_type == 'animation':
+            return await shard_bot.send_animation(chat_id=chat_id_int, animation=media, caption=full_message, parse_mode='Markdown', **extras)
+    return await shard_bot.send_message(chat_id=chat_id_int, text=full_message, parse_mode='Markdown', disable_web_page_preview=True, **extras)
+
+async def _midia_do_shard(shard_bot, bot_principal, dados: dict):
+    """Retorna a mídia do cabeçalho do tenant utilizável pelo shard.
+
+    file_ids são válidos apenas para o bot que os obteve: para os bots extras, a mídia é
+    baixada uma vez pelo bot principal e enviada como arquivo no primeiro envio; o file_id
+    resultante fica em cache em dados['cabecalho_media_shards'].
+    """
+    media_id = dados.get('cabecalho_media_id')
+    if not media_id or not dados.get('cabecalho_media_type') or shard_bot.id == bot_principal.id:
+        return media_id
+    cache = dados.setdefault('cabecalho_media_shards', {}).get(str(shard_bot.id))
+    if cache and cache.get('origem') == media_id:
+        return cache['file_id']
+    arquivo = await bot_principal.get_file(media_id)
+    return bytes(await arquivo.download_as_bytearray())
+
+async def _enviar_shard(shard_bot, fila: FilaShard, progresso: ProgressoEnvio) -> tuple:
+    """Esvazia a fila de um shard respeitando os limites do bot e de cada tenant."""
+    loop = asyncio.get_running_loop()
+    intervalo = 1 / SHARD_MSGS_POR_SEGUNDO
+    intervalo_tenant = 1 / TENANT_MSGS_POR_SEGUNDO if TENANT_MSGS_POR_SEGUNDO > 0 else 0
+    proximo_envio = loop.time()
+    enviados = 0
+    midias = {} # tenant_id -> mídia do cabeçalho utilizável por este shard
+    todos = todos_os_tenants()
+    mensagens = progresso.mensagens
+    proximo_por_tenant = progresso.proximo_por_tenant
+
+    while fila:
+        if not IS_LEADER or interrupcao_envio.is_set():
+            return shard_bot.id, enviados
+
+        tenant_id, chat_id_int = fila.proximo() # Continua pendente (no checkpoint) até ser registrado
+        espera = max(proximo_envio, proximo_por_tenant.get(tenant_id, 0)) - loop.time()
+        if espera > 0:
+            await _pausa_envio(espera)
+            if interrupcao_envio.is_set():
+                return shard_bot.id, enviados
+        agora = loop.time()
+        proximo_envio = max(proximo_envio, agora) + intervalo
+        proximo_por_tenant[tenant_id] = max(proximo_por_tenant.get(tenant_id, 0), agora) + intervalo_tenant
+
+        dados = todos[tenant_id]
+        media_type = dados.get('cabecalho_media_type')
+        if tenant_id not in midias:
+            try:
+                midias[tenant_id] = await _midia_do_shard(shard_bot, progresso.bot_principal, dados)
+            except Exception as e:
+                logger.error(f"Erro ao preparar a mídia do cabeçalho do tenant {tenant_id} para o bot {shard_bot.id}: {e}")
+                midias[tenant_id] = None # Envia apenas o texto em vez de falhar em todos os chats do shard
+        media = midias[tenant_id]
 
-    for chat_id_int in canais_cadastrados:
+        canal = dados['canais_e_grupos'].get(chat_id_int)
+        chat_name = canal.nome if canal else 'Desconhecido'
         try:
-            logger.debug(f"Tentando enviar para o canal/grupo: {chat_id_int}")
-            
-            if media_id and media_type:
-                if media_type == 'photo':
-                    await context.bot.send_photo(chat_id=chat_id_int, photo=media_id, caption=full_message, parse_mode='Markdown')
-                elif media_type == 'video':
-                    await context.bot.send_video(chat_id=chat_id_int, video=media_id, caption=full_message, parse_mode='Markdown')
-                elif media_type == 'animation':
-                    await context.bot.send_animation(chat_id=chat_id_int, animation=media_id, caption=full_message, parse_mode='Markdown')
-            else:
-                await context.bot.send_message(chat_id=chat_id_int, text=full_message, parse_mode='Markdown', disable_web_page_preview=True)
-            
-            sucessos += 1
+            logger.debug(f"Bot {shard_bot.id} tentando enviar para o canal/grupo: {chat_id_int} (tenant {tenant_id})")
+            try:
+                mensagem = await _enviar_para_chat(shard_bot, chat_id_int, mensagens[tenant_id], media, media_type)
+            except RetryAfter as e:
+                # Limite do Telegram atingido: aguarda o tempo pedido e tenta mais uma vez
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                logger.warning(f"Bot {shard_bot.id} limitado pelo Telegram. Aguardando {retry_after}s.")
+                await _pausa_envio(retry_after)
+                if interrupcao_envio.is_set():
+                    return shard_bot.id, enviados # O chat continua pendente no checkpoint
+                proximo_envio = loop.time() + intervalo
+                mensagem = await _enviar_para_chat(shard_bot, chat_id_int, mensagens[tenant_id], media, media_type)
+
+            if isinstance(media, bytes):
+                # Primeiro envio do shard com upload: passa a reutilizar o file_id gerado
+                file_id = _file_id_da_mensagem(mensagem, media_type)
+                if file_id:
+                    dados['cabecalho_media_shards'][str(shard_bot.id)] = {'origem': dados['cabecalho_media_id'], 'file_id': file_id}
+                    midias[tenant_id] = file_id
+                    progresso.tenants_alterados.add(tenant_id)
+
+            progresso.registrar(tenant_id, chat_id_int, 's')
+            enviados += 1
             logger.debug(f"Envio bem-sucedido para {chat_id_int}")
 
         except Forbidden:
-            falhas += 1
-            chat_name = bot_data['canais_e_grupos'].get(chat_id_int, {}).get('nome', 'Desconhecido')
-            falhas_detalhes.append(f"- **{chat_name}** (`{chat_id_int}`): Bot foi bloqueado ou removido. (Removido da lista)")
-            logger.warning(f"Bot foi bloqueado ou removido do chat: {chat_id_int}. Marcando para remoção.")
-            canais_para_remover.append(chat_id_int)
+            outros_bots = [b for b in (canal.bots if canal else ()) if b != shard_bot.id]
+            if outros_bots:
+                # Outros bots ainda são membros: remove apenas este bot do chat
+                progresso.registrar(tenant_id, chat_id_int, 'b', f"- **{chat_name}** (`{chat_id_int}`): Bot `{shard_bot.id}` foi bloqueado ou removido. (Chat mantido para os outros bots)", shard_bot.id)
+            else:
+                progresso.registrar(tenant_id, chat_id_int, 'c', f"- **{chat_name}** (`{chat_id_int}`): Bot foi bloqueado ou removido. (Removido da lista)")
+            logger.warning(f"Bot {shard_bot.id} foi bloqueado ou removido do chat: {chat_id_int}. Marcando para remoção.")
         except BadRequest as e:
-            falhas += 1
-            chat_name = bot_data['canais_e_grupos'].get(chat_id_int, {}).get('nome', 'Desconhecido')
-            falhas_detalhes.append(f"- **{chat_name}** (`{chat_id_int}`): Erro de requisição ({e}).")
+            progresso.registrar(tenant_id, chat_id_int, 'f', f"- **{chat_name}** (`{chat_id_int}`): Erro de requisição ({e}).")
             logger.error(f"Erro de BadRequest ao enviar para {chat_id_int}: {e}")
         except Exception as e:
-            falhas += 1
-            chat_name = bot_data['canais_e_grupos'].get(chat_id_int, {}).get('nome', 'Desconhecido')
-            falhas_detalhes.append(f"- **{chat_name}** (`{chat_id_int}`): Erro inesperado ({e}).")
+            progresso.registrar(tenant_id, chat_id_int, 'f', f"- **{chat_name}** (`{chat_id_int}`): Erro inesperado ({e}).")
             logger.error(f"Erro inesperado ao enviar para {chat_id_int}: {e}", exc_info=True)
 
-    # Remove os canais que causaram Forbidden APÓS o loop de envio
-    for chat_id_int_to_remove in canais_para_remover:
-        if chat_id_int_to_remove in bot_data['canais_e_grupos']:
-            del bot_data['canais_e_grupos'][chat_id_int_to_remove]
-    save_data() # Salva dados após todas as remoções
-
-    summary_message = f"**Relatório de Envio Diário:**\n" \
-                      f"✅ Sucessos: {sucessos}\n" \
-                      f"❌ Falhas: {falhas}\n"
-    if falhas > 0:
-        summary_message += "\n**Detalhes das Falhas:**\n" + "\n".join(falhas_detalhes)
-        
-    logger.info(f"Relatório de envio diário: Sucessos={sucessos}, Falhas={falhas}")
-    if ADMIN_CHAT_ID:
+    return shard_bot.id, enviados
+
+
+# --- Mídia do Cabeçalho (Pré-verificação e Upload Único) ---
+# Antes de cada envio, a mídia do cabeçalho (com a legenda real) é enviada uma única vez ao
+# chat de verificação: um file_id inválido ou uma legenda rejeitada aborta o envio do tenant
+# em vez de falhar em todos os chats. A mídia também pode vir de uma URL ou de um arquivo em
+# MIDIAS_DIR; o upload é feito uma vez e o file_id resultante é reutilizado em todos os envios.
+MIDIAS_DIR = os.getenv('MIDIAS_DIR', 'midias') # Único diretório de onde arquivos locais são aceitos
+# Chat usado na verificação e no upload (padrão: o chat do admin do tenant, com a mensagem apagada em seguida)
+CABECALHO_STAGING_CHAT_ID = int(os.getenv('CABECALHO_STAGING_CHAT_ID', 0)) or None
+EXTENSOES_MIDIA = {
+    '.jpg': 'photo', '.jpeg': 'photo', '.png': 'photo', '.webp': 'photo',
+    '.mp4': 'video', '.mov': 'video', '.webm': 'video',
+    '.gif': 'animation'
+}
+verificacoes_cabecalho = {} # tenant_id -> (media_id, hash da legenda) da última pré-verificação aceita
+TIPOS_MIDIA = {'foto': 'photo', 'photo': 'photo', 'video': 'video', 'gif': 'animation', 'animation': 'animation'}
+
+async def _enviar_verificacao(bot, tenant_id: int, media, media_type: str, legenda: str | None):
+    """Envia a mídia ao chat de verificação (sem notificação) e retorna a mensagem enviada."""
+    chat_id = CABECALHO_STAGING_CHAT_ID or tenant_id
+    try:
+        mensagem = await _enviar_para_chat(bot, chat_id, legenda, media, media_type, disable_notification=True)
+    except RetryAfter as e:
+        retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+        await _pausa_envio(retry_after)
+        if interrupcao_envio.is_set():
+            raise # Encerramento: não insiste
+        if hasattr(media, 'seek'):
+            media.seek(0) # A primeira tentativa já leu o arquivo: sem isso o reenvio sobe 0 bytes
+        mensagem = await _enviar_para_chat(bot, chat_id, legenda, media, media_type, disable_notification=True)
+    if chat_id == tenant_id:
         try:
-            await context.bot.send_message(chat_id=ADMIN_CHAT_ID, text=summary_message, parse_mode='Markdown')
+            await bot.delete_message(chat_id=chat_id, message_id=mensagem.message_id) # Não polui o chat do admin
         except Exception as e:
-            logger.error(f"Erro ao enviar relatório de envio ao admin: {e}")
+            logger.debug(f"Não foi possível apagar a mensagem de verificação: {e}")
+    return mensagem
+
+async def verificar_midia_cabecalho(bot, tenant_id: int, dados: dict, legenda: str) -> str | None:
+    """Pré-verificação do envio. Retorna None se a mídia do cabeçalho for aceita (ou não houver
+    mídia) e a descrição do erro se o Telegram a rejeitar.
+
+    Uma verificação bem-sucedida vale até a mídia ou a legenda mudar, para que os lotes pequenos
+    do agendador não paguem um envio de teste cada.
+    """
+    if not dados.get('cabecalho_media_id') or not dados.get('cabecalho_media_type'):
+        return None
+    chave = (dados['cabecalho_media_id'], hashlib.sha1(legenda.encode()).digest())
+    if verificacoes_cabecalho.get(tenant_id) == chave:
+        return None
+    try:
+        await _enviar_verificacao(bot, tenant_id, dados['cabecalho_media_id'], dados['cabecalho_media_type'], legenda)
+        verificacoes_cabecalho[tenant_id] = chave
+    except BadRequest as e:
+        # file_id expirado/de outro bot ou legenda inválida: falharia igualmente em todos os chats
+        logger.error(f"Pré-verificação da mídia do cabeçalho falhou (tenant {tenant_id}): {e}")
+        return str(e)
+    except Exception as e:
+        # Chat de verificação inacessível ou erro de rede: não diz nada sobre a mídia, segue o envio
+        logger.warning(f"Não foi possível pré-verificar a mídia do cabeçalho (tenant {tenant_id}): {e}")
+    return None
+
+async def definir_midia_cabecalho(bot, tenant_id: int, dados: dict, origem: str, media_type: str | None = None) -> tuple:
+    """Define a mídia do cabeçalho a partir de uma URL ou de um arquivo em MIDIAS_DIR.
+
+    Retorna (media_type, reutilizada). Levanta ValueError com a mensagem para o admin.
+    """
+    if origem.startswith(('http://', 'https://')):
+        caminho = None
+        chave = origem # O Telegram baixa a URL diretamente
+        extensao = os.path.splitext(urlparse(origem).path)[1].lower()
+    else:
+        base = os.path.realpath(MIDIAS_DIR)
+        caminho = os.path.realpath(os.path.join(base, origem))
+        if not caminho.startswith(base + os.sep) or not os.path.isfile(caminho):
+            raise ValueError(f"Arquivo não encontrado em `{MIDIAS_DIR}`: `{origem}`")
+        estado_arquivo = os.stat(caminho)
+        chave = f"{caminho}:{estado_arquivo.st_size}:{estado_arquivo.st_mtime_ns}" # Novo upload se o arquivo mudar
+        extensao = os.path.splitext(caminho)[1].lower()
+
+    media_type = media_type or EXTENSOES_MIDIA.get(extensao)
+    if media_type is None:
+        raise ValueError("Não foi possível identificar o tipo da mídia. Informe `foto`, `video` ou `gif` após a origem.")
+
+    if dados.get('cabecalho_media_origem') == chave and dados.get('cabecalho_media_type') == media_type and dados.get('cabecalho_media_id'):
+        return media_type, True # Já enviada: reutiliza o file_id guardado
+
+    try:
+        if caminho is None:
+            mensagem = await _enviar_verificacao(bot, tenant_id, origem, media_type, None)
+        else:
+            with open(caminho, 'rb') as arquivo:
+                mensagem = await _enviar_verificacao(bot, tenant_id, arquivo, media_type, None)
+    except (BadRequest, Forbidden) as e:
+        raise ValueError(f"O Telegram recusou a mídia: {e}")
+    except NetworkError as e:
+        # Inclui TimedOut (ex: upload de um vídeo grande): nada diz sobre a mídia, vale tentar de novo
+        raise ValueError(f"Falha de conexão ao enviar a mídia ({e}). Tente novamente.")
+    except TelegramError as e:
+        raise ValueError(f"Não foi possível enviar a mídia ({e}). Tente novamente.")
+
+    file_id = _file_id_da_mensagem(mensagem, media_type)
+    if not file_id:
+        raise ValueError("O Telegram não reconheceu a mídia com esse tipo. Tente informar `foto`, `video` ou `gif`.")
+    dados['cabecalho_media_id'] = file_id
+    dados['cabecalho_media_type'] = media_type
+    dados['cabecalho_media_origem'] = chave
+    save_data(tenant_id)
+    logger.info(f"Mídia do cabeçalho ({media_type}) enviada a partir de '{origem}' pelo admin {tenant_id}.")
+    return media_type, False
 
 
-async def agendar_daily_jobs_on_startup(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Agenda os jobs diários com base nos horários configurados."""
-    logger.info("Iniciando agendamento de jobs diários na inicialização.")
-    if not ADMIN_CHAT_ID:
-        logger.warning("Não há ADMIN_CHAT_ID definido. Não é possível agendar trabalhos.")
+# --- Funções de Agendamento ---
+@instrumentar
+def montar_mensagem(dados: dict) -> str:
+    """Monta a divulgação do tenant: cabeçalho seguido dos links de todos os seus canais/grupos."""
+    cabecalho = dados.get('cabecalho_texto', CABECALHO_PADRAO)
+
+    # Monta a mensagem completa (a lista de links fica em cache no registro até ele mudar)
+    return f"{cabecalho}{dados['canais_e_grupos'].links_mensagem()}"
+
+async def send_daily_posts(context: ContextTypes.DEFAULT_TYPE, job_data: dict | None = None) -> None:
+    """Envia as publicações agendadas para os canais/grupos cadastrados.
+
+    Sem parâmetros envia para todos os chats de todos os tenants. job_data['tenant'] restringe
+    a um tenant e o agendador passa em job_data['lotes'] ({tenant_id: [chats]}) apenas o lote vencido.
+    Um envio interrompido que esteja no checkpoint é sempre retomado junto; job_data['retomar']
+    retoma apenas ele (e não faz nada se não houver checkpoint).
+    """
+    if not IS_LEADER:
+        logger.warning("Instância não é a líder. Envio de posts diários ignorado.")
         return
 
-    agenda_info = bot_data['agendamentos'].get(ADMIN_CHAT_ID, {}) # Usar ADMIN_CHAT_ID como int
-    horarios_str = agenda_info.get('horarios', [])
-    ativo = agenda_info.get('ativo', False)
+    if job_data is None:
+        job_data = context.job.data if context.job and isinstance(context.job.data, dict) else {}
+    # Com um envio em andamento, o novo lote entra nas filas dos shards em vez de esperar ele
+    # terminar: os tenants dividem os shards em rodízio
+    if estado_envio_atual is not None and not encerrando and not job_data.get('retomar'):
+        if await _incluir_no_envio(context, estado_envio_atual, job_data):
+            return
+    # Um envio por vez (o checkpoint acompanha um envio); chega aqui só se o anterior já estava finalizando
+    async with envio_lock:
+        if encerrando:
+            # Não inicia novos envios durante o encerramento; lotes agendados vão para o checkpoint
+            _adiar_envio(job_data)
+            return
+        await _executar_envio(context, job_data)
+
+async def _itens_do_envio(context: ContextTypes.DEFAULT_TYPE, job_data: dict, todos: dict) -> tuple:
+    """Resolve os pares (tenant_id, chat_id) de um envio novo e os tenants que recebem relatório."""
+    if 'lotes' in job_data:
+        lotes = job_data['lotes']
+        relatorios = set(job_data.get('relatorio', []))
+        logger.info(f"Iniciando o envio de posts agendados para {sum(map(len, lotes.values()))} chats de {len(lotes)} tenant(s).")
+    else:
+        alvos = [job_data['tenant']] if 'tenant' in job_data else list(todos)
+        lotes = {t: list(todos[t]['canais_e_grupos'].keys()) for t in alvos if t in todos}
+        relatorios = set(lotes)
+        logger.info("Iniciando o envio de posts diários.")
+
+    itens = []
+    for tenant_id, chats in lotes.items():
+        canais = todos.get(tenant_id, {}).get('canais_e_grupos', {})
+        canais_cadastrados = [c for c in chats if c in canais]
+        random.shuffle(canais_cadastrados) # Opcional: embaralhar a ordem
+        itens.extend((tenant_id, c) for c in canais_cadastrados)
+
+        if not canais and 'lotes' not in job_data:
+            logger.info(f"Nenhum canal ou grupo cadastrado para envio (tenant {tenant_id}).")
+            try:
+                await context.bot.send_message(
+                    chat_id=tenant_id,
+                    text="⚠️ Não há canais/grupos cadastrados para o envio agendado. ⚠️",
+                    parse_mode='Markdown'
+                )
+            except Exception as e:
+                logger.error(f"Erro ao enviar mensagem de aviso ao admin: {e}")
+    return itens, relatorios
+
+async def _verificar_tenants(context: ContextTypes.DEFAULT_TYPE, mensagens: dict, todos: dict) -> dict:
+    """Pré-verificação da mídia do cabeçalho: um envio de teste por tenant em vez de N falhas.
+    Retorna {tenant_id: erro} dos tenants cuja mídia foi rejeitada."""
+    tenants_envio = list(mensagens)
+    erros = await asyncio.gather(*(
+        verificar_midia_cabecalho(context.bot, tenant_id, todos[tenant_id], mensagens[tenant_id]) for tenant_id in tenants_envio
+    ))
+    return {tenant_id: erro for tenant_id, erro in zip(tenants_envio, erros) if erro is not None}
+
+async def _avisar_envio_abortado(context: ContextTypes.DEFAULT_TYPE, tenant_id: int, erro: str) -> None:
+    try:
+        await context.bot.send_message(
+            chat_id=tenant_id,
+            text=f"❌ **Envio abortado:** a mídia do cabeçalho foi rejeitada na verificação (`{erro}`).\n"
+                 "Os canais/grupos restantes não receberam a publicação. Atualize a mídia com /editarcabecalho ou /midiacabecalho.",
+            parse_mode='Markdown'
+        )
+    except Exception as e:
+        logger.error(f"Erro ao avisar o admin sobre a falha na pré-verificação: {e}")
+
+async def _incluir_no_envio(context: ContextTypes.DEFAULT_TYPE, progresso: ProgressoEnvio, job_data: dict) -> bool:
+    """Inclui um lote no envio em andamento. Retorna False se o envio já estiver finalizando."""
+    todos = todos_os_tenants()
+    itens, relatorios = await _itens_do_envio(context, job_data, todos)
+    mensagens = {t: montar_mensagem(todos[t]) for t in {t for t, _ in itens} if t not in progresso.mensagens}
+    abortados = await _verificar_tenants(context, mensagens, todos)
+    if not progresso.aceitando:
+        return False # As filas já esvaziaram: o lote segue como um envio novo
+
+    # Daqui até incluir() não há await: o envio não pode finalizar com o lote pela metade
+    for tenant_id, mensagem in mensagens.items():
+        if tenant_id not in abortados:
+            progresso.mensagens[tenant_id] = mensagem
+            progresso.resultados.setdefault(tenant_id, resultado_vazio())
+    progresso.relatorios |= relatorios & progresso.mensagens.keys()
+    itens = [(t, c) for t, c in itens if t not in abortados and (t, c) not in progresso.pendentes]
+    progresso.incluir(itens)
+    progresso.gravar_retrato()
+    logger.info(f"Lote com {len(itens)} chats incluído no envio em andamento ({len(progresso.pendentes)} chats pendentes).")
+
+    for tenant_id, erro in abortados.items():
+        await _avisar_envio_abortado(context, tenant_id, erro)
+    return True
+
+async def _executar_envio(context: ContextTypes.DEFAULT_TYPE, job_data: dict) -> None:
+    """Executa um envio (novo ou retomado a partir do checkpoint)."""
+    global estado_envio_atual
+    # Sempre lê o checkpoint: um envio interrompido ainda não retomado entra no envio atual
+    # em vez de ser sobrescrito por ele (perdendo os chats pendentes e as remoções)
+    checkpoint = carregar_checkpoint()
+    todos = todos_os_tenants()
+
+    if job_data.get('retomar'):
+        if not checkpoint:
+            # Outro envio já absorveu o checkpoint: não há nada a retomar (e nunca envia para todos)
+            logger.info("Nenhum envio interrompido para retomar.")
+            return
+        itens, relatorios = [], set()
+    else:
+        itens, relatorios = await _itens_do_envio(context, job_data, todos)
+
+    if checkpoint:
+        # Retoma um envio interrompido (ex: o líder anterior caiu no meio do envio), junto com o novo lote
+        logger.info(f"Retomando envio interrompido: {len(checkpoint['pendentes'])} chats pendentes.")
+        novos = set(itens)
+        herdados = [
+            (t, c) for t, c in checkpoint['pendentes']
+            if (t, c) not in novos and c in todos.get(t, {}).get('canais_e_grupos', {})
+        ]
+        itens = herdados + itens
+        resultados = {int(t): r for t, r in checkpoint['resultados'].items() if int(t) in todos}
+        relatorios |= set(checkpoint['relatorio'])
+    else:
+        resultados = {}
+
+    if not itens and not checkpoint:
+        return
 
-    # Remove todos os jobs antigos para evitar duplicações
-    current_jobs = context.job_queue.get_jobs_by_name("daily_post_job")
-    for job in current_jobs:
-        job.schedule_removal()
-        logger.info(f"Job existente 'daily_post_job' removido: {job.next_run_time}")
+    mensagens = {}
+    for tenant_id in {t for t, _ in itens} | set(resultados):
+        mensagens[tenant_id] = montar_mensagem(todos[tenant_id])
+        resultados.setdefault(tenant_id, resultado_vazio())
+
+    progresso = ProgressoEnvio(resultados, itens, relatorios, mensagens) # Compartilhado entre os shards
+
+    # O lote fica no checkpoint antes de qualquer chamada à API (inclusive a pré-verificação)
+    progresso.gravar_retrato()
+    estado_envio_atual = progresso # Permite incluir lotes e, ao encerramento, gravar o progresso
+
+    try:
+        abortados = await _verificar_tenants(context, mensagens, todos)
+        if abortados:
+            # Pula só o envio: os resultados (inclusive os herdados de um envio retomado, com suas
+            # remoções por Forbidden) continuam sendo aplicados e relatados ao final
+            for tenant_id in abortados:
+                del mensagens[tenant_id]
+            progresso.pendentes = {item: None for item in progresso.pendentes if item[0] not in abortados}
+            progresso.gravar_retrato() # Sem os chats dos tenants abortados
+            for tenant_id, erro in abortados.items():
+                await _avisar_envio_abortado(context, tenant_id, erro)
+
+        # Distribui os chats (inclusive os de lotes incluídos durante a pré-verificação) entre os
+        # bots (shards) e envia em paralelo até as filas esvaziarem
+        progresso.shards = await obter_shards(context)
+        progresso.bot_principal = context.bot
+        progresso.incluir(list(progresso.pendentes))
+        await progresso.aguardar()
+    finally:
+        progresso.aceitando = False
+        estado_envio_atual = None
+
+    pendentes = progresso.pendentes
+    if not IS_LEADER:
+        # Outro líder assumiu: ele retomará a partir do último checkpoint gravado
+        logger.warning(f"Liderança perdida durante o envio. Interrompido com {len(pendentes)} chats pendentes.")
+        return
 
-    if not ativo or not horarios_str:
-        logger.info("Agendamento desativado ou sem horários definidos para o admin. Nenhum job será agendado.")
-        if ADMIN_CHAT_ID and ADMIN_CHAT_ID in bot_data['agendamentos'] and bot_data['agendamentos'][ADMIN_CHAT_ID].get('ativo'):
-             try:
-                 await context.bot.send_message(chat_id=ADMIN_CHAT_ID, text="Agendamento desativado ou sem horários. Jobs anteriores removidos.")
-             except Exception as e:
-                 logger.error(f"Erro ao enviar mensagem de desativação de agendamento ao admin: {e}")
+    if interrupcao_envio.is_set() and pendentes:
+        # Encerramento: grava o progresso exato (inclusive remoções pendentes); o próximo líder
+        # retoma os chats restantes, aplica as remoções e envia o relatório
+        progresso.gravar()
+        logger.warning(f"Envio interrompido pelo encerramento com {len(pendentes)} chats pendentes (gravados no checkpoint).")
         return
 
-    agendados_com_sucesso = []
-    for horario_str in horarios_str:
+    envios_por_shard = list(progresso.enviados.items())
+    relatorios = progresso.relatorios
+
+    # Remove os canais que causaram Forbidden APÓS o loop de envio
+    for tenant_id, r in resultados.items():
+        canais = todos[tenant_id]['canais_e_grupos']
+        for chat_id_int, bot_id in r['bots_para_remover']:
+            canal = canais.get(chat_id_int)
+            if canal and bot_id in canal.bots:
+                canal.bots = tuple(b for b in canal.bots if b != bot_id)
+        for chat_id_int_to_remove in r['canais_para_remover']:
+            if chat_id_int_to_remove in canais:
+                del canais[chat_id_int_to_remove]
+        # Salva dados após todas as remoções (lotes sem alterações não regravam o tenant)
+        if r['canais_para_remover'] or r['bots_para_remover'] or tenant_id in progresso.tenants_alterados:
+            save_data(tenant_id)
+    limpar_checkpoint()
+
+    for tenant_id, r in resultados.items():
+        sucessos = r['sucessos']
+        falhas = r['falhas']
+        summary_message = f"**Relatório de Envio Diário:**\n" \
+                          f"✅ Sucessos: {sucessos}\n" \
+                          f"❌ Falhas: {falhas}\n"
+        if tenant_id == ADMIN_CHAT_ID and len(envios_por_shard) > 1:
+            summary_message += "\n**Envios por bot:**\n" + "\n".join(
+                f"🤖 `{bot_id}`: {total} chats" for bot_id, total in envios_por_shard
+            ) + "\n"
+        if falhas > 0:
+            summary_message += "\n**Detalhes das Falhas:**\n" + "\n".join(r['falhas_detalhes'])
+
+        logger.info(f"Relatório de envio diário (tenant {tenant_id}): Sucessos={sucessos}, Falhas={falhas}, Shards={len(envios_por_shard)}")
+        # Lotes de agendamentos por chat só geram relatório quando há falhas, para não inundar o admin
+        if tenant_id in relatorios or falhas > 0:
+            try:
+                await context.bot.send_message(chat_id=tenant_id, text=summary_message, parse_mode='Markdown')
+            except Exception as e:
+                logger.error(f"Erro ao enviar relatório de envio ao admin: {e}")
+
+
+# --- Agendador (Min-Heap) ---
+# Um único agendador atende os agendamentos de todos os tenants: em cada tenant,
+# agendamentos[tenant_id] é o agendamento padrão (todos os chats sem agendamento próprio) e as
+# demais chaves são chats (ou grupos de chats, via 'chats') com horários e fuso ('fuso') próprios.
+# Cada par (agendamento, horário) é uma entrada no heap; o agendador dorme até a próxima entrada
+# vencer e dispara de uma vez todos os chats do lote, com custo O(log n) por entrada.
+fila_agendamentos = [] # Heap de (quando_ts, seq, tenant_id, chave, horario_str, versao)
+versoes_agendamentos = {} # (tenant_id, chave) -> versão atual; entradas com versão antiga são descartadas
+contador_fila = itertools.count() # Desempate estável para entradas com o mesmo horário
+despertar_agendador = asyncio.Event() # Acorda o agendador quando o heap muda
+tarefa_agendador = None
+envio_lock = asyncio.Lock() # Serializa os envios (o checkpoint acompanha um envio por vez)
+# Ocorrências perdidas há mais que isso (ex: bot parado por um dia) não são recuperadas na inicialização
+AGENDAMENTO_RECUPERACAO_MAX = float(os.getenv('AGENDAMENTO_RECUPERACAO_MAX', 6 * 3600))
+
+def fuso_do_agendamento(agenda_info: dict):
+    """Retorna o fuso horário do agendamento (ou o TIMEZONE padrão)."""
+    nome_fuso = agenda_info.get('fuso')
+    if nome_fuso:
         try:
-            # Converte o horário para um objeto time aware do fuso horário definido
-            h_naive = datetime.time.fromisoformat(horario_str)
-            # Combina com uma data mínima e localiza no fuso horário para obter um datetime aware
-            # Em seguida, extrai apenas a parte do tempo aware para usar com run_daily
-            h_aware = TIMEZONE.localize(datetime.datetime.combine(datetime.date.min, h_naive)).time()
-
-            job = context.job_queue.run_daily(
-                send_daily_posts,
-                time=h_aware, # Usa o objeto time com fuso horário
-                days=tuple(range(7)),  # Todos os dias da semana
-                data={'admin_id': ADMIN_CHAT_ID},
+            return pytz.timezone(nome_fuso)
+        except pytz.UnknownTimeZoneError:
+            logger.error(f"Fuso horário inválido '{nome_fuso}' no agendamento. Usando o padrão.")
+    return TIMEZONE
+
+def proxima_execucao(horario_str: str, fuso, apos: datetime.datetime) -> datetime.datetime:
+    """Retorna o próximo instante (UTC) em que horario_str ocorre no fuso, depois de `apos`."""
+    h_naive = datetime.time.fromisoformat(horario_str)
+    data = apos.astimezone(fuso).date()
+    while True:
+        # localize aplica o deslocamento correto do dia (inclusive horário de verão)
+        quando = fuso.localize(datetime.datetime.combine(data, h_naive))
+        if quando > apos:
+            return quando.astimezone(pytz.utc)
+        data += timedelta(days=1)
+
+def agendar_chave(tenant_id: int, chave: int, disparos: dict | None = None) -> list:
+    """(Re)enfileira os horários de um agendamento, invalidando as entradas antigas da chave.
+
+    Com `disparos` (últimos disparos gravados, na inicialização), uma ocorrência que venceu
+    desde o último disparo (ex: durante um redeploy ou troca de líder) é enfileirada no seu
+    horário original e dispara imediatamente, se não tiver passado de AGENDAMENTO_RECUPERACAO_MAX.
+    Retorna a lista de (horario_str, próxima execução) agendados.
+    """
+    versao = versoes_agendamentos.get((tenant_id, chave), 0) + 1
+    versoes_agendamentos[(tenant_id, chave)] = versao
+    agenda_info = todos_os_tenants().get(tenant_id, {}).get('agendamentos', {}).get(chave, {})
+    agendados = []
+    if agenda_info.get('ativo'):
+        fuso = fuso_do_agendamento(agenda_info)
+        agora = datetime.datetime.now(pytz.utc)
+        for horario_str in agenda_info.get('horarios', []):
+            try:
+                quando = proxima_execucao(horario_str, fuso, agora)
+                ultimo = (disparos or {}).get((tenant_id, chave, horario_str))
+                if ultimo is not None:
+                    perdida = proxima_execucao(horario_str, fuso, datetime.datetime.fromtimestamp(ultimo, pytz.utc))
+                    if perdida <= agora and (agora - perdida).total_seconds() <= AGENDAMENTO_RECUPERACAO_MAX:
+                        logger.info(f"Recuperando o horário {horario_str} perdido do agendamento {chave} (tenant {tenant_id}).")
+                        quando = perdida
+            except ValueError:
+                logger.error(f"Horário inválido '{horario_str}' no agendamento {chave} (tenant {tenant_id}). Ignorando.")
+                continue
+            heapq.heappush(fila_agendamentos, (quando.timestamp(), next(contador_fila), tenant_id, chave, horario_str, versao))
+            agendados.append((horario_str, quando))
+    despertar_agendador.set()
+    return agendados
+
+def chats_do_agendamento(tenant_id: int, chave: int, agenda_info: dict) -> list:
+    """Resolve os chats cadastrados do tenant atendidos por um agendamento."""
+    dados = todos_os_tenants().get(tenant_id, {})
+    canais = dados.get('canais_e_grupos', {})
+    if 'chats' in agenda_info:
+        return [c for c in agenda_info['chats'] if c in canais]
+    if chave != tenant_id:
+        return [chave] if chave in canais else []
+    # Agendamento padrão: todos os chats que não têm agendamento próprio ativo
+    proprios = set()
+    for outra_chave, outra_info in dados.get('agendamentos', {}).items():
+        if outra_chave != tenant_id and outra_info.get('ativo'):
+            proprios.update(outra_info.get('chats', [outra_chave]))
+    return [c for c in canais if c not in proprios]
+
+async def executar_agendador(application: Application) -> None:
+    """Loop do agendador: dorme até a próxima entrada do heap e dispara os lotes vencidos."""
+    logger.info("Agendador iniciado.")
+    while True:
+        despertar_agendador.clear()
+        espera = fila_agendamentos[0][0] - time.time() if fila_agendamentos else None
+        if espera is None or espera > 0:
+            try:
+                await asyncio.wait_for(despertar_agendador.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        agora = time.time()
+        lotes = {} # tenant_id -> chats (dict para manter a ordem sem duplicar)
+        relatorio = set()
+        disparos = []
+        while fila_agendamentos and fila_agendamentos[0][0] <= agora:
+            quando_ts, _, tenant_id, chave, horario_str, versao = heapq.heappop(fila_agendamentos)
+            if versoes_agendamentos.get((tenant_id, chave)) != versao:
+                continue # Entrada de uma versão antiga do agendamento
+            disparos.append((tenant_id, chave, horario_str, quando_ts))
+            agenda_info = todos_os_tenants().get(tenant_id, {}).get('agendamentos', {}).get(chave, {})
+            lotes.setdefault(tenant_id, {}).update(dict.fromkeys(chats_do_agendamento(tenant_id, chave, agenda_info)))
+            if chave == tenant_id:
+                relatorio.add(tenant_id)
+
+            # Re-enfileira a próxima ocorrência (após o horário atual, sem repetir atrasos)
+            apos = datetime.datetime.fromtimestamp(max(quando_ts, agora), pytz.utc)
+            proxima = proxima_execucao(horario_str, fuso_do_agendamento(agenda_info), apos)
+            heapq.heappush(fila_agendamentos, (proxima.timestamp(), next(contador_fila), tenant_id, chave, horario_str, versao))
+
+        registrar_disparos(disparos)
+        lotes = {tenant_id: list(chats) for tenant_id, chats in lotes.items() if chats}
+        if lotes:
+            logger.info(f"Agendador disparando lote com {sum(map(len, lotes.values()))} chats de {len(lotes)} tenant(s).")
+            application.job_queue.run_once(
+                instrumentar(send_daily_posts), 0,
+                data={'lotes': lotes, 'relatorio': list(relatorio)},
                 name="daily_post_job"
             )
-            # Calcula a próxima execução no fuso horário *definido* para o feedback
-            # job.next_run_time já está em UTC. Convertemos para o fuso horário que o usuário configurou para exibição.
-            next_run_display = job.next_run_time.astimezone(TIMEZONE).strftime('%d/%m %H:%M')
-            agendados_com_sucesso.append(f"• {horario_str} (próxima execução: {next_run_display})")
-            logger.info(f"Job 'daily_post_job' agendado para {horario_str} ({TIMEZONE.tzname(datetime.datetime.now())}). Próxima execução (UTC): {job.next_run_time}")
-        except ValueError:
-            logger.error(f"Horário inválido '{horario_str}' no agendamento. Ignorando.")
-        except Exception as e:
-            logger.error(f"Erro inesperado ao agendar para '{horario_str}': {e}", exc_info=True)
 
-    if agendados_com_sucesso and ADMIN_CHAT_ID:
+def parar_agendador() -> None:
+    """Cancela o agendador e esvazia o heap."""
+    global tarefa_agendador
+    if tarefa_agendador and not tarefa_agendador.done():
+        tarefa_agendador.cancel()
+    tarefa_agendador = None
+    fila_agendamentos.clear()
+    versoes_agendamentos.clear()
+
+def _iniciar_agendador(application: Application) -> None:
+    global tarefa_agendador
+    if encerrando:
+        return
+    if tarefa_agendador is None or tarefa_agendador.done():
+        tarefa_agendador = asyncio.create_task(executar_agendador(application))
+
+async def _notificar_agendamento(context: ContextTypes.DEFAULT_TYPE, tenant_id: int, agendados: list) -> None:
+    """Informa ao admin do tenant os horários do agendamento padrão."""
+    agenda_info = todos_os_tenants().get(tenant_id, {}).get('agendamentos', {}).get(tenant_id, {})
+    if not agenda_info.get('ativo', False) or not agenda_info.get('horarios', []):
+        logger.info(f"Agendamento desativado ou sem horários definidos para o admin {tenant_id}. Nenhum envio padrão será agendado.")
+        return
+
+    agendados_com_sucesso = []
+    for horario_str, quando in agendados:
+        # Mostra a próxima execução no fuso horário que o usuário configurou
+        next_run_display = quando.astimezone(TIMEZONE).strftime('%d/%m %H:%M')
+        agendados_com_sucesso.append(f"• {horario_str} (próxima execução: {next_run_display})")
+        logger.info(f"Post diário agendado para {horario_str} ({TIMEZONE.tzname(datetime.datetime.now())}). Próxima execução (UTC): {quando}")
+
+    if agendados_com_sucesso:
         try:
             await context.bot.send_message(
-                chat_id=ADMIN_CHAT_ID,
+                chat_id=tenant_id,
                 text="✅ **Agendamentos de posts diários ativos:**\n" + "\n".join(agendados_com_sucesso) + f"\n\n*(Horários em {TIMEZONE.tzname(datetime.datetime.now())})*",
                 parse_mode='Markdown'
             )
         except Exception as e:
             logger.error(f"Erro ao enviar confirmação de agendamento ao admin: {e}")
-    elif ADMIN_CHAT_ID:
+    else:
         try:
             await context.bot.send_message(
-                chat_id=ADMIN_CHAT_ID,
+                chat_id=tenant_id,
                 text="❌ **Nenhum agendamento diário válido foi configurado ou ativado.** Use /agendar para definir horários."
             )
         except Exception as e:
             logger.error(f"Erro ao enviar mensagem de nenhum agendamento ao admin: {e}")
 
+async def reagendar_tenant(context: ContextTypes.DEFAULT_TYPE, tenant_id: int) -> None:
+    """Reenfileira os agendamentos de um tenant após uma alteração e avisa o admin."""
+    if not IS_LEADER:
+        logger.warning("Instância não é a líder. Nenhum job será agendado.")
+        return
+    dados = todos_os_tenants().get(tenant_id, {})
+    for chave in dados.get('agendamentos', {}):
+        if chave != tenant_id:
+            agendar_chave(tenant_id, chave)
+    agendados = agendar_chave(tenant_id, tenant_id)
+    _iniciar_agendador(context.application)
+    await _notificar_agendamento(context, tenant_id, agendados)
+
+async def agendar_daily_jobs_on_startup(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Agenda os posts diários de todos os tenants com base nos horários configurados."""
+    logger.info("Iniciando agendamento de jobs diários na inicialização.")
+    if not IS_LEADER:
+        logger.warning("Instância não é a líder. Nenhum job será agendado.")
+        return
+    if not ADMIN_CHAT_ID:
+        logger.warning("Não há ADMIN_CHAT_ID definido. Não é possível agendar trabalhos.")
+        return
+
+    # Reconstrói o heap do zero para evitar duplicações, recuperando os horários que venceram
+    # enquanto nenhuma instância era líder (redeploy ou troca de líder)
+    fila_agendamentos.clear()
+    disparos = carregar_disparos()
+    agendados_admin = []
+    for tenant_id, dados in todos_os_tenants().items():
+        for chave in dados['agendamentos']:
+            agendados = agendar_chave(tenant_id, chave, disparos)
+            if tenant_id == ADMIN_CHAT_ID and chave == ADMIN_CHAT_ID:
+                agendados_admin = agendados
+    logger.info(f"Heap de agendamentos reconstruído com {len(fila_agendamentos)} entradas.")
+    _iniciar_agendador(context.application)
+
+    # Na inicialização só o dono do bot é avisado (evita notificar todos os tenants a cada deploy)
+    await _notificar_agendamento(context, ADMIN_CHAT_ID, agendados_admin)
+
+
+# --- Roteador de Callbacks ---
+# callback_data tem no máximo 64 bytes. Cada botão carrega apenas "<rota>|<payload>", com a rota
+# despachada em O(1) por ROTAS_CALLBACK e o payload codificado de forma compacta (base36 ou o
+# token de um estado guardado no servidor, em CacheEstado).
+ROTAS_CALLBACK = {} # rota -> async (update, context, tenant_id, dados, payload)
+LIMITE_CALLBACK_DATA = 64
+
+ROTAS_QUE_RESPONDEM = set() # Rotas que chamam query.answer() por conta própria (ex: para exibir um aviso)
+
+def rota_callback(rota: str, responde: bool = False):
+    """Decorador que registra o handler de uma rota de callback.
+
+    Com responde=True o handler é responsável por chamar query.answer() (o Telegram aceita uma
+    única resposta por callback); nas demais rotas o despachante responde antes de chamá-lo.
+    """
+    def registrar(funcao):
+        ROTAS_CALLBACK[rota] = funcao
+        if responde:
+            ROTAS_QUE_RESPONDEM.add(rota)
+        return funcao
+    return registrar
+
+def callback_data(rota: str, *partes) -> str:
+    """Monta o callback_data de uma rota, validando o limite de 64 bytes do Telegram."""
+    data = f"{rota}|{'.'.join(map(str, partes))}" if partes else rota
+    if len(data.encode()) > LIMITE_CALLBACK_DATA:
+        raise ValueError(f"callback_data excede {LIMITE_CALLBACK_DATA} bytes: {data}")
+    return data
+
+def para_base36(numero: int) -> str:
+    """Codifica um inteiro (inclusive chat_ids negativos) em base36."""
+    digitos = '0123456789abcdefghijklmnopqrstuvwxyz'
+    sinal, numero = ('-', -numero) if numero < 0 else ('', numero)
+    codificado = ''
+    while True:
+        numero, resto = divmod(numero, 36)
+        codificado = digitos[resto] + codificado
+        if not numero:
+            return sinal + codificado
+
+class CacheEstado:
+    """Cache LRU com TTL para o estado de ações interativas (seleções, cursores de página).
+
+    Os botões carregam apenas o token do estado; o estado em si fica no servidor.
+    """
+    __slots__ = ('_itens', '_capacidade', '_ttl')
+
+    def __init__(self, capacidade: int, ttl: float):
+        self._itens = OrderedDict() # token -> (expira_em, estado), do menos ao mais recente
+        self._capacidade = capacidade
+        self._ttl = ttl
+
+    def guardar(self, estado) -> str:
+        token = secrets.token_urlsafe(6)
+        self._itens[token] = (time.monotonic() + self._ttl, estado)
+        while len(self._itens) > self._capacidade:
+            self._itens.popitem(last=False) # Descarta o menos usado
+        return token
+
+    def obter(self, token: str):
+        """Retorna o estado (renovando o TTL) ou None se não existir ou tiver expirado."""
+        item = self._itens.get(token)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del self._itens[token]
+            return None
+        self._itens[token] = (time.monotonic() + self._ttl, item[1])
+        self._itens.move_to_end(token)
+        return item[1]
+
+    def remover(self, token: str) -> None:
+        self._itens.pop(token, None)
+
+estados_callback = CacheEstado(
+    capacidade=int(os.getenv('CALLBACK_CACHE_CAPACIDADE', 1000)),
+    ttl=float(os.getenv('CALLBACK_CACHE_TTL', 900)) # Segundos sem uso até o estado expirar
+)
+
 
 # --- Handlers de Comandos ---
 
@@ -275,14 +1705,26 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             f"Olá, {user_name}! Você foi definido como o administrador deste bot.\n\n"
             "Use /ajuda para ver os comandos disponíveis."
         )
+        if MULTI_TENANT and chat_id not in tenants:
+            criar_tenant(chat_id)
         # Tenta agendar jobs se já houver horários configurados para o novo admin
         # CHAMADA AQUI É CRUCIAL PARA INICIALIZAR JOBS SE HOUVER ADMIN
-        await agendar_daily_jobs_on_startup(context)
-    elif chat_id == ADMIN_CHAT_ID:
+        await reagendar_tenant(context, chat_id)
+    elif obter_tenant(chat_id) is not None:
         await update.message.reply_text(
             f"Bem-vindo de volta, {user_name}! Você é o administrador.\n"
             "Use /ajuda para ver os comandos disponíveis."
         )
+    elif update.message.chat.type == 'private' and pode_criar_tenant(chat_id):
+        # Modo multi-tenant: cada novo admin ganha sua própria lista de divulgação
+        criar_tenant(chat_id)
+        logger.info(f"Novo tenant criado por {user_name} ({chat_id}).")
+        await update.message.reply_text(
+            f"Olá, {user_name}! Sua lista de divulgação foi criada e você é o administrador dela.\n\n"
+            f"Para cadastrar canais/grupos nela, os donos devem usar `/cadastrar {chat_id}`.\n"
+            "Use /ajuda para ver os comandos disponíveis."
+            , parse_mode='Markdown'
+        )
     else:
         await update.message.reply_text(
             f"Olá, {user_name}! Eu sou um bot de divulgação de canais e grupos. "
@@ -292,6 +1734,23 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def cadastrar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Solicita o link do canal/grupo para cadastro."""
+    if MULTI_TENANT:
+        # Define em qual lista (tenant) o canal/grupo será cadastrado: a do próprio admin ou a informada
+        user_id = update.message.from_user.id
+        tenant_id = user_id if user_id in tenants else None
+        if context.args:
+            try:
+                tenant_id = int(context.args[0])
+            except ValueError:
+                tenant_id = None
+        if tenant_id not in tenants:
+            await update.message.reply_text(
+                "Informe o ID da lista de divulgação em que deseja se cadastrar: `/cadastrar <id>`.\n"
+                "Peça esse ID ao administrador da lista."
+                , parse_mode='Markdown'
+            )
+            return
+        context.user_data['tenant_cadastro'] = tenant_id
     context.user_data['estado'] = 'aguardando_link_cadastro'
     context.user_data['user_id_cadastro'] = update.message.from_user.id # Guarda o ID do usuário que pediu o cadastro
     await update.message.reply_text(
@@ -306,31 +1765,59 @@ async def ver_canais_e_grupos(update: Update, context: ContextTypes.DEFAULT_TYPE
     # update pode ser Message ou CallbackQuery, precisamos adaptar
     message = update.message if update.message else update.callback_query.message
 
-    if message.chat.id != ADMIN_CHAT_ID:
+    tenant_id = message.chat.id
+    dados = obter_tenant(tenant_id)
+    if dados is None:
         await message.reply_text("Desculpe, este comando é apenas para administradores.")
         return
 
-    canais = bot_data.get('canais_e_grupos', {})
+    canais = dados.get('canais_e_grupos', {})
     if not canais:
         await message.reply_text("Nenhum canal ou grupo cadastrado ainda.")
         return
 
-    mensagem = "Canais e Grupos Cadastrados:\n\n"
-    for chat_id_int, info in canais.items(): # Itera sobre inteiros
+    # Uma página por vez (navegação pelos botões), para não estourar o limite de tamanho de
+    # mensagem nem disparar milhares de mensagens seguidas em registros grandes
+    texto, reply_markup = _tela_canais(canais, 0)
+    await message.reply_text(texto, reply_markup=reply_markup, parse_mode='Markdown')
+
+def _tela_canais(canais: RegistroCanais, pagina: int) -> tuple:
+    """Monta o texto e os botões de navegação de uma página da lista de canais."""
+    total_paginas = max(1, -(-len(canais) // CANAIS_POR_PAGINA))
+    pagina = max(0, min(pagina, total_paginas - 1))
+    mensagem = f"Canais e Grupos Cadastrados (página {pagina + 1}/{total_paginas}):\n\n"
+    for chat_id_int, canal in canais.pagina(pagina * CANAIS_POR_PAGINA, CANAIS_POR_PAGINA):
         mensagem += (
-            f"**Nome:** `{info.get('nome', 'N/A')}`\n"
-            f"**Tipo:** `{info.get('tipo', 'N/A')}`\n"
-            f"**Membros:** `{info.get('membros', 'N/A')}`\n"
-            f"**Link:** {info.get('link', 'Não disponível')}\n"
+            f"**Nome:** `{canal.nome or 'N/A'}`\n"
+            f"**Tipo:** `{canal.tipo or 'N/A'}`\n"
+            f"**Link:** {canal.link or 'Não disponível'}\n"
             f"**ID:** `{chat_id_int}`\n\n" # Exibe o ID como inteiro
         )
-    await message.reply_text(mensagem, parse_mode='Markdown')
+
+    navegacao = []
+    if pagina > 0:
+        navegacao.append(InlineKeyboardButton("⬅️", callback_data=callback_data('vp', pagina - 1)))
+    if pagina < total_paginas - 1:
+        navegacao.append(InlineKeyboardButton("➡️", callback_data=callback_data('vp', pagina + 1)))
+    return mensagem, InlineKeyboardMarkup([navegacao]) if navegacao else None
+
+@rota_callback('vp')
+async def _rota_pagina_canais(update: Update, context: ContextTypes.DEFAULT_TYPE, tenant_id: int, dados: dict, payload: str) -> None:
+    """Mostra outra página da lista de canais (payload: número da página)."""
+    canais = dados['canais_e_grupos']
+    if not canais:
+        await update.callback_query.edit_message_text("Nenhum canal ou grupo cadastrado ainda.")
+        return
+    texto, reply_markup = _tela_canais(canais, int(payload))
+    await update.callback_query.edit_message_text(texto, reply_markup=reply_markup, parse_mode='Markdown')
 
 # Novo comando para iniciar o fluxo de edição do cabeçalho
 async def editar_cabecalho(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Inicia o fluxo de edição do cabeçalho com opções de botões."""
     message = update.message if update.message else update.callback_query.message
-    if message.chat.id != ADMIN_CHAT_ID:
+    tenant_id = message.chat.id
+    dados = obter_tenant(tenant_id)
+    if dados is None:
         await message.reply_text("Desculpe, este comando é apenas para administradores.")
         return
 
@@ -346,14 +1833,48 @@ async def editar_cabecalho(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         reply_markup=reply_markup
     )
 
+async def midia_cabecalho(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Define a mídia do cabeçalho a partir de uma URL ou arquivo local (/midiacabecalho <origem> [foto|video|gif])."""
+    message = update.message if update.message else update.callback_query.message
+    tenant_id = message.chat.id
+    dados = obter_tenant(tenant_id)
+    if dados is None:
+        await message.reply_text("Desculpe, este comando é apenas para administradores.")
+        return
+
+    args = context.args or []
+    if not args or len(args) > 2 or (len(args) == 2 and args[1].lower() not in TIPOS_MIDIA):
+        await message.reply_text(
+            "Uso: `/midiacabecalho <url ou arquivo> [foto|video|gif]`\n"
+            f"Arquivos locais são lidos de `{MIDIAS_DIR}`. O tipo é deduzido da extensão quando omitido.",
+            parse_mode='Markdown'
+        )
+        return
+    await _aplicar_midia_cabecalho(message, context, tenant_id, dados, args[0], TIPOS_MIDIA.get(args[1].lower()) if len(args) == 2 else None)
+
+async def _aplicar_midia_cabecalho(message, context: ContextTypes.DEFAULT_TYPE, tenant_id: int, dados: dict, origem: str, media_type: str | None) -> None:
+    await message.reply_text("Enviando a mídia para o Telegram...")
+    try:
+        media_type, reutilizada = await definir_midia_cabecalho(context.bot, tenant_id, dados, origem, media_type)
+    except ValueError as e:
+        await message.reply_text(f"❌ {e}", parse_mode='Markdown')
+        return
+    context.user_data.pop('estado', None)
+    if reutilizada:
+        await message.reply_text(f"✅ Essa mídia ({media_type}) já está no cabeçalho. O upload anterior será reutilizado.")
+    else:
+        await message.reply_text(f"✅ Mídia do cabeçalho ({media_type}) atualizada com sucesso! Ela será reutilizada em todos os envios.")
+
 async def agendar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Inicia o processo de agendamento de posts diários."""
     message = update.message if update.message else update.callback_query.message
-    if message.chat.id != ADMIN_CHAT_ID:
+    tenant_id = message.chat.id
+    dados = obter_tenant(tenant_id)
+    if dados is None:
         await message.reply_text("Desculpe, este comando é apenas para administradores.")
         return
     context.user_data['estado'] = 'aguardando_horarios_agendamento'
-    current_schedule_info = bot_data['agendamentos'].get(ADMIN_CHAT_ID, {})
+    current_schedule_info = dados['agendamentos'].get(tenant_id, {})
     current_horarios = current_schedule_info.get('horarios', [])
     status_agenda = "Ativo" if current_schedule_info.get('ativo', False) else "Inativo"
     
@@ -363,19 +1884,22 @@ async def agendar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         f"Agendamentos atuais: {', '.join(current_horarios) if current_horarios else 'Nenhum'}\n"
         f"Status: {status_agenda}\n"
         f"*(Horário de referência: {TIMEZONE.tzname(datetime.datetime.now())})*\n" # Informa o fuso horário
+        "Para horários próprios de um canal/grupo, use /agendarcanal.\n"
         "Envie /cancelar para abortar."
     )
 
 async def parar_agendamento(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Para o agendamento de posts diários."""
     message = update.message if update.message else update.callback_query.message
-    if message.chat.id != ADMIN_CHAT_ID:
+    tenant_id = message.chat.id
+    dados = obter_tenant(tenant_id)
+    if dados is None:
         await message.reply_text("Desculpe, este comando é apenas para administradores.")
         return
-    if ADMIN_CHAT_ID and ADMIN_CHAT_ID in bot_data['agendamentos']:
-        bot_data['agendamentos'][ADMIN_CHAT_ID]['ativo'] = False
-        save_data()
-        await agendar_daily_jobs_on_startup(context) # Re-agendará, desativando os jobs
+    if tenant_id in dados['agendamentos']:
+        dados['agendamentos'][tenant_id]['ativo'] = False
+        save_data(tenant_id)
+        await reagendar_tenant(context, tenant_id) # Re-agendará, desativando os jobs
         await message.reply_text("Agendamento de posts diários pausado.")
     else:
         await message.reply_text("Nenhum agendamento ativo para pausar.")
@@ -383,29 +1907,231 @@ async def parar_agendamento(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def retomar_agendamento(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Retoma o agendamento de posts diários."""
     message = update.message if update.message else update.callback_query.message
-    if message.chat.id != ADMIN_CHAT_ID:
+    tenant_id = message.chat.id
+    dados = obter_tenant(tenant_id)
+    if dados is None:
         await message.reply_text("Desculpe, este comando é apenas para administradores.")
         return
-    if ADMIN_CHAT_ID and ADMIN_CHAT_ID in bot_data['agendamentos']:
-        if bot_data['agendamentos'][ADMIN_CHAT_ID].get('horarios'):
-            bot_data['agendamentos'][ADMIN_CHAT_ID]['ativo'] = True
-            save_data()
-            await agendar_daily_jobs_on_startup(context) # Re-agendará, ativando os jobs
+    if tenant_id in dados['agendamentos']:
+        if dados['agendamentos'][tenant_id].get('horarios'):
+            dados['agendamentos'][tenant_id]['ativo'] = True
+            save_data(tenant_id)
+            await reagendar_tenant(context, tenant_id) # Re-agendará, ativando os jobs
             await message.reply_text("Agendamento de posts diários retomado.")
         else:
             await message.reply_text("Não há horários agendados para retomar. Use /agendar primeiro.")
     else:
         await message.reply_text("Nenhum agendamento configurado para retomar. Use /agendar primeiro.")
 
+async def agendar_canal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Define horários (e fuso) próprios para um chat ou grupo de chats.
+
+    Uso: /agendarcanal <id>[,<id>...] <HH:MM>[,<HH:MM>...] [fuso]  ou  /agendarcanal <id> off
+    """
+    message = update.message if update.message else update.callback_query.message
+    tenant_id = message.chat.id
+    dados = obter_tenant(tenant_id)
+    if dados is None:
+        await message.reply_text("Desculpe, este comando é apenas para administradores.")
+        return
+
+    args = context.args or []
+    if len(args) < 2:
+        proprios = [
+            f"• `{chave}`{' (+' + str(len(info['chats']) - 1) + ' chats)' if len(info.get('chats', [])) > 1 else ''}: "
+            f"{', '.join(info.get('horarios', []))} ({info.get('fuso', TIMEZONE.zone)}){'' if info.get('ativo') else ' - inativo'}"
+            for chave, info in dados['agendamentos'].items() if chave != tenant_id
+        ]
+        await message.reply_text(
+            "Uso: `/agendarcanal <id>[,<id>...] <HH:MM>[,<HH:MM>...] [fuso]`\n"
+            "Ex: `/agendarcanal -1001234567890 09:00,21:00 Europe/Lisbon`\n"
+            "Para remover: `/agendarcanal <id> off`\n\n"
+            "Chats sem agendamento próprio seguem o agendamento padrão (/agendar).\n\n"
+            "**Agendamentos próprios:**\n" + ("\n".join(proprios) if proprios else "Nenhum"),
+            parse_mode='Markdown'
+        )
+        return
+
+    try:
+        chats = [int(c) for c in args[0].split(',') if c.strip()]
+    except ValueError:
+        await message.reply_text("IDs de chat inválidos. Use os IDs mostrados em /vercanais.")
+        return
+    chave = chats[0]
+    if chave == tenant_id:
+        await message.reply_text("Use /agendar para o agendamento padrão.")
+        return
+
+    if args[1].lower() == 'off':
+        dados['agendamentos'].pop(chave, None)
+        save_data(tenant_id)
+        agendar_chave(tenant_id, chave) # Invalida as entradas do heap
+        agendar_chave(tenant_id, tenant_id) # Os chats voltam para o agendamento padrão
+        await message.reply_text(f"Agendamento próprio de `{chave}` removido.", parse_mode='Markdown')
+        return
+
+    horarios = [h.strip() for h in args[1].split(',') if h.strip()]
+    try:
+        for h in horarios:
+            datetime.time.fromisoformat(h) # Valida o formato HH:MM
+    except ValueError:
+        await message.reply_text("Horários inválidos. Use o formato HH:MM (ex: `09:00,21:00`).", parse_mode='Markdown')
+        return
+
+    agenda_info = {'horarios': horarios, 'ativo': True}
+    if len(args) > 2:
+        try:
+            pytz.timezone(args[2])
+        except pytz.UnknownTimeZoneError:
+            await message.reply_text(f"Fuso horário desconhecido: `{args[2]}`.", parse_mode='Markdown')
+            return
+        agenda_info['fuso'] = args[2]
+    if len(chats) > 1:
+        agenda_info['chats'] = chats
+
+    dados['agendamentos'][chave] = agenda_info
+    save_data(tenant_id)
+    agendados = agendar_chave(tenant_id, chave)
+    _iniciar_agendador(context.application)
+    fuso = fuso_do_agendamento(agenda_info)
+    await message.reply_text(
+        f"✅ Agendamento próprio salvo para {len(chats)} chat(s):\n" +
+        "\n".join(f"• {h} (próxima execução: {q.astimezone(fuso).strftime('%d/%m %H:%M')})" for h, q in agendados) +
+        f"\n\n*(Horários em {fuso.zone})*",
+        parse_mode='Markdown'
+    )
+
 async def testar_envio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Testa o envio de uma publicação para os canais/grupos cadastrados."""
     message = update.message if update.message else update.callback_query.message
+    tenant_id = message.chat.id
+    dados = obter_tenant(tenant_id)
+    if dados is None:
+        await message.reply_text("Desculpe, este comando é apenas para administradores.")
+        return
+    # Roda como job, fora do handler: um envio longo não trava o atendimento dos demais updates
+    context.job_queue.run_once(instrumentar(send_daily_posts), 0, data={'tenant': tenant_id}, name="test_post_job")
+    await message.reply_text(
+        "Testando o envio de publicação para os canais/grupos cadastrados...\n"
+        "O relatório será enviado neste chat quando o envio terminar."
+    )
+
+async def atualizar_shards(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Verifica quais bots (shards) são membros de cada canal/grupo cadastrado."""
+    message = update.message if update.message else update.callback_query.message
+    tenant_id = message.chat.id
+    dados = obter_tenant(tenant_id)
+    if dados is None:
+        await message.reply_text("Desculpe, este comando é apenas para administradores.")
+        return
+    if tenant_id in atualizacoes_shards:
+        await message.reply_text("Já existe uma verificação de shards em andamento. Aguarde o resultado.")
+        return
+
+    canais = dados.get('canais_e_grupos', {})
+    shards = await obter_shards(context)
+    await message.reply_text(
+        f"Verificando {len(shards)} bot(s) em {len(canais)} canais/grupos...\n"
+        "O resultado será enviado neste chat quando a verificação terminar."
+    )
+    # Em segundo plano: em registros grandes a verificação leva muito tempo e não pode travar os updates
+    atualizacoes_shards.add(tenant_id)
+    _tarefa_de_fundo(_verificar_shards(context, tenant_id, canais, shards))
+
+async def _verificar_shards(context: ContextTypes.DEFAULT_TYPE, tenant_id: int, canais: RegistroCanais, shards: list) -> None:
+    try:
+        sem_bots = 0
+        intervalo = 1 / SHARD_MSGS_POR_SEGUNDO # Cada bot faz uma consulta por chat: respeita o limite de cada um
+        for chat_id_int in list(canais.keys()):
+            canal = canais.get(chat_id_int)
+            membros = await detectar_bots_membros(chat_id_int, context, canal.bots if canal else ())
+            await asyncio.sleep(intervalo)
+            if chat_id_int in canais:
+                canais[chat_id_int].bots = tuple(membros)
+                sem_bots += not membros
+        save_data(tenant_id)
+
+        particao = particionar_chats([(tenant_id, c) for c in canais], shards)
+        await context.bot.send_message(
+            chat_id=tenant_id,
+            text="✅ **Shards atualizados:**\n" +
+                 "\n".join(f"🤖 `{bot_id}`: {len(chats)} chats" for bot_id, chats in particao.items()) +
+                 (f"\n\n⚠️ {sem_bots} chat(s) sem nenhum bot membro." if sem_bots else ""),
+            parse_mode='Markdown'
+        )
+    except asyncio.CancelledError:
+        # Encerramento: os chats já verificados são gravados junto com os demais dados
+        logger.warning(f"Verificação de shards do tenant {tenant_id} interrompida pelo encerramento.")
+        raise
+    except Exception as e:
+        logger.error(f"Erro na verificação de shards do tenant {tenant_id}: {e}", exc_info=True)
+        try:
+            await context.bot.send_message(chat_id=tenant_id, text=f"❌ A verificação de shards falhou: {e}")
+        except Exception as e:
+            logger.error(f"Erro ao avisar o admin sobre a falha na verificação de shards: {e}")
+    finally:
+        atualizacoes_shards.discard(tenant_id)
+
+async def buscar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Busca canais/grupos cadastrados por nome, id ou link (/buscar <texto>)."""
+    message = update.message if update.message else update.callback_query.message
+    tenant_id = message.chat.id
+    dados = obter_tenant(tenant_id)
+    if dados is None:
+        await message.reply_text("Desculpe, este comando é apenas para administradores.")
+        return
+
+    consulta = ' '.join(context.args or [])
+    if not consulta:
+        await message.reply_text("Uso: /buscar <nome, id ou link>\nDica: você também pode digitar @<usuário do bot> <texto> em qualquer chat.")
+        return
+
+    encontrados = dados['canais_e_grupos'].buscar(consulta, CANAIS_POR_PAGINA)
+    if not encontrados:
+        await message.reply_text("Nenhum canal ou grupo encontrado.")
+        return
+
+    mensagem = f"Resultados para `{consulta}`:\n\n"
+    keyboard = []
+    for chat_id_int, canal in encontrados:
+        mensagem += (
+            f"**Nome:** `{canal.nome or 'N/A'}`\n"
+            f"**Link:** {canal.link or 'Não disponível'}\n"
+            f"**ID:** `{chat_id_int}`\n\n"
+        )
+        keyboard.append([InlineKeyboardButton(f"🗑 Remover {canal.nome or chat_id_int}", callback_data=callback_data('rm', para_base36(chat_id_int)))])
+    await message.reply_text(mensagem, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Mostra os percentis de tempo por handler/job, as chamadas à API e o atraso do event loop."""
+    message = update.message if update.message else update.callback_query.message
+    if message.chat.id != ADMIN_CHAT_ID: # Métricas do processo inteiro: só o admin principal
+        await message.reply_text("Desculpe, este comando é apenas para administradores.")
+        return
+    if not PROFILING_ATIVO:
+        await message.reply_text("A instrumentação está desativada. Defina PROFILING_ATIVO=1 e reinicie o bot. (/perfil funciona mesmo assim.)")
+        return
+    await message.reply_text(relatorio_stats(), parse_mode='Markdown')
+
+async def perfil(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Captura um cProfile dos próximos N segundos e o envia como documento (/perfil [segundos])."""
+    message = update.message if update.message else update.callback_query.message
     if message.chat.id != ADMIN_CHAT_ID:
         await message.reply_text("Desculpe, este comando é apenas para administradores.")
         return
-    await message.reply_text("Testando o envio de publicação para os canais/grupos cadastrados...")
-    await send_daily_posts(context)
-    await message.reply_text("Teste de envio concluído. Verifique o relatório no seu chat (se houver falhas).")
+    if perfil_em_andamento:
+        await message.reply_text("Já existe uma captura de perfil em andamento.")
+        return
+    try:
+        segundos = int(context.args[0]) if context.args else 30
+    except ValueError:
+        await message.reply_text("Uso: /perfil [segundos]")
+        return
+    segundos = max(1, min(segundos, PERFIL_MAX_SEGUNDOS))
+
+    # Em uma tarefa separada, para não bloquear o processamento dos próximos updates
+    _tarefa_de_fundo(capturar_perfil(context.bot, segundos))
+    await message.reply_text(f"Capturando perfil pelos próximos {segundos}s. O resultado será enviado aqui.")
 
 async def ajuda(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Mostra os comandos disponíveis, com botões para administradores."""
@@ -425,7 +2151,7 @@ async def ajuda(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     keyboard = []
     reply_markup = None
 
-    if user_chat_id == ADMIN_CHAT_ID:
+    if obter_tenant(user_chat_id) is not None:
         help_message += "👑 **Comandos de Administrador (apenas para você):**\n"
         
         # Cria os botões para os comandos de administrador
@@ -436,6 +2162,12 @@ async def ajuda(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         keyboard.append([InlineKeyboardButton("Retomar Agendamento", callback_data="admin_retomar_agendamento")])
         keyboard.append([InlineKeyboardButton("Testar Envio Agora", callback_data="admin_testar_envio")])
         keyboard.append([InlineKeyboardButton("Remover Canal", callback_data="admin_remover_canal")])
+        if BOT_TOKENS_EXTRAS:
+            keyboard.append([InlineKeyboardButton("Atualizar Shards", callback_data="admin_atualizar_shards")])
+        help_message += "/midiacabecalho <url ou arquivo> [foto|video|gif] - Define a mídia do cabeçalho a partir de um link ou arquivo.\n"
+        help_message += "/buscar <texto> - Busca canais/grupos por nome, id ou link (ou @bot <texto> em qualquer chat).\n"
+        if user_chat_id == ADMIN_CHAT_ID:
+            help_message += "/stats - Tempos por handler, chamadas à API e atraso do event loop.\n/perfil [segundos] - Captura um cProfile e envia como documento.\n"
         
         reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -450,109 +2182,204 @@ async def cancelar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         context.user_data.pop('estado', None) # Remove de forma segura
         context.user_data.pop('user_id_cadastro', None) # Remove o user_id_cadastro
         context.user_data.pop('cadastrando_link', None) # Remove o link de cadastro
+        context.user_data.pop('tenant_cadastro', None) # Remove o tenant de destino do cadastro
         await message.reply_text("Operação cancelada.")
     else:
         await message.reply_text("Nenhuma operação em andamento para cancelar.")
 
 async def remover_canal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Inicia o processo de remoção de um canal/grupo."""
+    """Inicia o processo de remoção de canais/grupos (seleção paginada com remoção em lote)."""
     message = update.message if update.message else update.callback_query.message
-    if message.chat.id != ADMIN_CHAT_ID:
+    tenant_id = message.chat.id
+    dados = obter_tenant(tenant_id)
+    if dados is None:
         await message.reply_text("Desculpe, este comando é apenas para administradores.")
         return
 
-    canais = bot_data.get('canais_e_grupos', {})
+    canais = dados.get('canais_e_grupos', {})
     if not canais:
         await message.reply_text("Nenhum canal ou grupo cadastrado para remover.")
         return
 
+    estado = {'tenant': tenant_id, 'pagina': 0, 'ids_pagina': [], 'selecionados': set()}
+    token = estados_callback.guardar(estado)
+    texto, reply_markup = _tela_remocao(token, estado, canais)
+    await message.reply_text(texto, reply_markup=reply_markup)
+
+def _tela_remocao(token: str, estado: dict, canais: RegistroCanais) -> tuple:
+    """Monta o texto e o teclado da página atual da seleção de remoção."""
+    total_paginas = max(1, -(-len(canais) // CANAIS_POR_PAGINA))
+    estado['pagina'] = min(estado['pagina'], total_paginas - 1)
+    pagina = canais.pagina(estado['pagina'] * CANAIS_POR_PAGINA, CANAIS_POR_PAGINA)
+    estado['ids_pagina'] = [chat_id_int for chat_id_int, _ in pagina] # Os botões referenciam a posição na página
+
     keyboard = []
-    # Usar o ID inteiro para o callback_data para consistência
-    for chat_id_int, info in canais.items():
-        keyboard.append([InlineKeyboardButton(info.get('nome', f"ID: {chat_id_int}"), callback_data=f"remove_chat_{chat_id_int}")])
+    for i, (chat_id_int, canal) in enumerate(pagina):
+        marcador = "✅" if chat_id_int in estado['selecionados'] else "⬜"
+        keyboard.append([InlineKeyboardButton(f"{marcador} {canal.nome or f'ID: {chat_id_int}'}", callback_data=callback_data('rs', token, i))])
+
+    navegacao = []
+    if estado['pagina'] > 0:
+        navegacao.append(InlineKeyboardButton("⬅️", callback_data=callback_data('rp', token, estado['pagina'] - 1)))
+    if estado['pagina'] < total_paginas - 1:
+        navegacao.append(InlineKeyboardButton("➡️", callback_data=callback_data('rp', token, estado['pagina'] + 1)))
+    if navegacao:
+        keyboard.append(navegacao)
+    keyboard.append([
+        InlineKeyboardButton(f"🗑 Remover selecionados ({len(estado['selecionados'])})", callback_data=callback_data('rc', token)),
+        InlineKeyboardButton("Cancelar", callback_data=callback_data('rx', token))
+    ])
+
+    texto = f"Selecione os canais/grupos que deseja remover (página {estado['pagina'] + 1}/{total_paginas}):"
+    return texto, InlineKeyboardMarkup(keyboard)
+
+def _estado_remocao(payload: str, tenant_id: int) -> tuple:
+    """Resolve o estado da seleção de remoção a partir do payload '<token>[.<n>]'."""
+    token, _, argumento = payload.partition('.')
+    estado = estados_callback.obter(token)
+    if estado is None or estado['tenant'] != tenant_id:
+        return token, None, argumento
+    return token, estado, argumento
+
+@rota_callback('rs')
+async def _rota_selecionar_remocao(update: Update, context: ContextTypes.DEFAULT_TYPE, tenant_id: int, dados: dict, payload: str) -> None:
+    """Marca/desmarca um canal na seleção de remoção."""
+    token, estado, argumento = _estado_remocao(payload, tenant_id)
+    if estado is None:
+        await update.callback_query.edit_message_text("Esta seleção expirou. Use /removercanal novamente.")
+        return
+    chat_id_int = estado['ids_pagina'][int(argumento)]
+    estado['selecionados'] ^= {chat_id_int}
+    texto, reply_markup = _tela_remocao(token, estado, dados['canais_e_grupos'])
+    await update.callback_query.edit_message_text(texto, reply_markup=reply_markup)
+
+@rota_callback('rp')
+async def _rota_pagina_remocao(update: Update, context: ContextTypes.DEFAULT_TYPE, tenant_id: int, dados: dict, payload: str) -> None:
+    """Muda de página na seleção de remoção."""
+    token, estado, argumento = _estado_remocao(payload, tenant_id)
+    if estado is None:
+        await update.callback_query.edit_message_text("Esta seleção expirou. Use /removercanal novamente.")
+        return
+    estado['pagina'] = max(0, int(argumento))
+    texto, reply_markup = _tela_remocao(token, estado, dados['canais_e_grupos'])
+    await update.callback_query.edit_message_text(texto, reply_markup=reply_markup)
+
+@rota_callback('rc', responde=True)
+async def _rota_confirmar_remocao(update: Update, context: ContextTypes.DEFAULT_TYPE, tenant_id: int, dados: dict, payload: str) -> None:
+    """Remove de uma vez todos os canais selecionados."""
+    token, estado, _ = _estado_remocao(payload, tenant_id)
+    if estado is not None and not estado['selecionados']:
+        await update.callback_query.answer("Nenhum canal/grupo selecionado.", show_alert=True)
+        return
+    await update.callback_query.answer()
+    if estado is None:
+        await update.callback_query.edit_message_text("Esta seleção expirou. Use /removercanal novamente.")
+        return
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await message.reply_text(
-        "Selecione o canal/grupo que deseja remover:",
-        reply_markup=reply_markup
+    canais = dados['canais_e_grupos']
+    removidos = []
+    for chat_id_int in estado['selecionados']:
+        if chat_id_int in canais:
+            removidos.append(f"• **{canais[chat_id_int].nome}** (`{chat_id_int}`)")
+            del canais[chat_id_int]
+    estados_callback.remover(token)
+    save_data(tenant_id)
+    await update.callback_query.edit_message_text(
+        f"{len(removidos)} canal(is)/grupo(s) removido(s) com sucesso da lista:\n" + "\n".join(removidos),
+        parse_mode='Markdown'
+    )
+    logger.info(f"{len(removidos)} canais/grupos removidos pelo admin {tenant_id}.")
+
+@rota_callback('rx')
+async def _rota_cancelar_remocao(update: Update, context: ContextTypes.DEFAULT_TYPE, tenant_id: int, dados: dict, payload: str) -> None:
+    estados_callback.remover(payload)
+    await update.callback_query.edit_message_text("Remoção cancelada.")
+
+@rota_callback('rm')
+async def _rota_remover_canal(update: Update, context: ContextTypes.DEFAULT_TYPE, tenant_id: int, dados: dict, payload: str) -> None:
+    """Remove um único canal/grupo (payload: chat_id em base36)."""
+    chat_id_to_remove = int(payload, 36)
+    if chat_id_to_remove in dados['canais_e_grupos']:
+        removed_name = dados['canais_e_grupos'][chat_id_to_remove].nome
+        del dados['canais_e_grupos'][chat_id_to_remove]
+        save_data(tenant_id)
+        await update.callback_query.edit_message_text(f"Canal/grupo **'{removed_name}'** (`{chat_id_to_remove}`) removido com sucesso da lista.", parse_mode='Markdown')
+        logger.info(f"Canal/grupo '{removed_name}' ({chat_id_to_remove}) removido pelo admin.")
+    else:
+        await update.callback_query.edit_message_text("Canal/grupo não encontrado na lista.")
+
+# --- Callbacks para o fluxo de edição de cabeçalho ---
+@rota_callback('edit_header_text')
+async def _rota_editar_texto_cabecalho(update: Update, context: ContextTypes.DEFAULT_TYPE, tenant_id: int, dados: dict, payload: str) -> None:
+    context.user_data['estado'] = 'aguardando_texto_cabecalho_fluxo'
+    await update.callback_query.edit_message_text(
+        f"Por favor, envie o novo texto para o cabeçalho. O texto atual é:\n\n`{dados.get('cabecalho_texto', 'Nenhum')}`\n\n"
+        "Você pode usar formatação Markdown (ex: **negrito**, _itálico_)."
+        "Envie /cancelar para abortar."
+    , parse_mode='Markdown')
+
+@rota_callback('edit_header_media')
+async def _rota_editar_midia_cabecalho(update: Update, context: ContextTypes.DEFAULT_TYPE, tenant_id: int, dados: dict, payload: str) -> None:
+    context.user_data['estado'] = 'aguardando_media_cabecalho_fluxo'
+    await update.callback_query.edit_message_text(
+        "Por favor, envie a nova foto, GIF ou vídeo para o cabeçalho, ou um link (URL) da mídia. "
+        "A mídia atual será substituída. Envie /cancelar para abortar."
     )
 
+@rota_callback('remove_header_media')
+async def _rota_remover_midia_cabecalho(update: Update, context: ContextTypes.DEFAULT_TYPE, tenant_id: int, dados: dict, payload: str) -> None:
+    dados['cabecalho_media_id'] = None
+    dados['cabecalho_media_type'] = None
+    dados['cabecalho_media_origem'] = None
+    save_data(tenant_id)
+    await update.callback_query.edit_message_text("Mídia do cabeçalho removida com sucesso!")
+    logger.info(f"Mídia do cabeçalho removida pelo admin {tenant_id}.")
+
+# --- Lógicas para os botões de ADMIN ---
+def _atalho_admin(texto: str, comando):
+    """Cria a rota de um botão do menu de ajuda que apenas executa um comando de admin."""
+    async def executar(update: Update, context: ContextTypes.DEFAULT_TYPE, tenant_id: int, dados: dict, payload: str) -> None:
+        await update.callback_query.edit_message_text(texto)
+        await comando(update, context) # Passa update completo para a função
+    return executar
+
+for _rota, (_texto, _comando) in {
+    'admin_ver_canais': ("Carregando lista de canais...", ver_canais_e_grupos),
+    'admin_editar_cabecalho': ("Iniciando edição do cabeçalho...", editar_cabecalho),
+    'admin_agendar': ("Iniciando configuração de agendamento...", agendar),
+    'admin_parar_agendamento': ("Pausando agendamento...", parar_agendamento),
+    'admin_retomar_agendamento': ("Retomando agendamento...", retomar_agendamento),
+    'admin_testar_envio': ("Testando envio...", testar_envio),
+    'admin_remover_canal': ("Preparando remoção de canal...", remover_canal),
+    'admin_atualizar_shards': ("Atualizando shards...", atualizar_shards),
+}.items():
+    ROTAS_CALLBACK[_rota] = _atalho_admin(_texto, _comando)
+
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Processa as chamadas de retorno de botões inline."""
+    """Processa as chamadas de retorno de botões inline, despachando pela rota do callback_data."""
     query = update.callback_query
-    await query.answer() # Sempre responda à callback_query para remover o "carregando" do botão
+    rota, _, payload = query.data.partition('|')
+    if rota.startswith('remove_chat_'):
+        # Botões gerados antes do roteador carregavam o chat_id em decimal
+        rota, payload = 'rm', para_base36(int(rota[len('remove_chat_'):]))
+
+    handler = ROTAS_CALLBACK.get(rota)
+    if handler is None or rota not in ROTAS_QUE_RESPONDEM or obter_tenant(query.message.chat.id) is None:
+        await query.answer() # Sempre responda à callback_query para remover o "carregando" do botão
+
+    if handler is None:
+        logger.warning(f"Callback com rota desconhecida: {query.data}")
+        await query.edit_message_text("Esta ação não está mais disponível.")
+        return
 
-    # Verificação de segurança: Apenas o ADMIN_CHAT_ID pode usar os botões de administrador
-    # (Ou botões que ele iniciou, como remover_canal)
-    # Permite que não-admins cliquem em botões de remoção que o admin gerou
-    if query.message.chat.id != ADMIN_CHAT_ID and not query.data.startswith('remove_chat_'):
+    # Verificação de segurança: Apenas o admin do tenant pode usar os botões
+    tenant_id = query.message.chat.id
+    dados = obter_tenant(tenant_id)
+    if dados is None:
         await query.edit_message_text("Desculpe, esta ação é apenas para administradores.")
         return
 
-    if query.data.startswith('remove_chat_'):
-        # Note: o ID no callback_data vem como string. Converter para int para buscar no bot_data.
-        chat_id_to_remove = int(query.data.replace('remove_chat_', ''))
-        
-        if chat_id_to_remove in bot_data['canais_e_grupos']:
-            removed_name = bot_data['canais_e_grupos'][chat_id_to_remove]['nome']
-            del bot_data['canais_e_grupos'][chat_id_to_remove]
-            save_data()
-            await query.edit_message_text(f"Canal/grupo **'{removed_name}'** (`{chat_id_to_remove}`) removido com sucesso da lista.", parse_mode='Markdown')
-            logger.info(f"Canal/grupo '{removed_name}' ({chat_id_to_remove}) removido pelo admin.")
-        else:
-            await query.edit_message_text("Canal/grupo não encontrado na lista.")
-
-    # --- Lógicas para os botões de ADMIN ---
-    elif query.data == 'admin_ver_canais':
-        await query.edit_message_text("Carregando lista de canais...")
-        await ver_canais_e_grupos(update, context) # Passa update completo para a função
-    
-    elif query.data == 'admin_editar_cabecalho':
-        await query.edit_message_text("Iniciando edição do cabeçalho...")
-        await editar_cabecalho(update, context)
-
-    elif query.data == 'admin_agendar':
-        await query.edit_message_text("Iniciando configuração de agendamento...")
-        await agendar(update, context)
-
-    elif query.data == 'admin_parar_agendamento':
-        await query.edit_message_text("Pausando agendamento...")
-        await parar_agendamento(update, context)
-
-    elif query.data == 'admin_retomar_agendamento':
-        await query.edit_message_text("Retomando agendamento...")
-        await retomar_agendamento(update, context)
-
-    elif query.data == 'admin_testar_envio':
-        await query.edit_message_text("Testando envio...")
-        await testar_envio(update, context)
-
-    elif query.data == 'admin_remover_canal':
-        await query.edit_message_text("Preparando remoção de canal...")
-        await remover_canal(update, context)
-    
-    # --- Callbacks para o fluxo de edição de cabeçalho ---
-    elif query.data == 'edit_header_text':
-        context.user_data['estado'] = 'aguardando_texto_cabecalho_fluxo'
-        await query.edit_message_text(
-            f"Por favor, envie o novo texto para o cabeçalho. O texto atual é:\n\n`{bot_data.get('cabecalho_texto', 'Nenhum')}`\n\n"
-            "Você pode usar formatação Markdown (ex: **negrito**, _itálico_)."
-            "Envie /cancelar para abortar."
-        , parse_mode='Markdown')
-
-    elif query.data == 'edit_header_media':
-        context.user_data['estado'] = 'aguardando_media_cabecalho_fluxo'
-        await query.edit_message_text(
-            "Por favor, envie a nova foto, GIF ou vídeo para o cabeçalho. "
-            "A mídia atual será substituída. Envie /cancelar para abortar."
-        )
-    
-    elif query.data == 'remove_header_media':
-        bot_data['cabecalho_media_id'] = None
-        bot_data['cabecalho_media_type'] = None
-        save_data()
-        await query.edit_message_text("Mídia do cabeçalho removida com sucesso!")
-        logger.info(f"Mídia do cabeçalho removida pelo admin {ADMIN_CHAT_ID}.")
+    await handler(update, context, tenant_id, dados, payload)
 
 
 # --- Handlers de Mensagens ---
@@ -565,6 +2392,7 @@ async def handle_text_response(update: Update, context: ContextTypes.DEFAULT_TYP
 
     user_chat_id = update.message.chat_id
     current_state = context.user_data.get('estado')
+    dados = obter_tenant(user_chat_id) # None se o chat não for admin de um tenant
 
     # Lida com o estado de cadastro de link (acessível a qualquer um)
     if current_state == 'aguardando_link_cadastro':
@@ -601,7 +2429,6 @@ async def handle_text_response(update: Update, context: ContextTypes.DEFAULT_TYP
             )
             # Define o próximo estado para aguardar a adição do bot
             context.user_data['estado'] = 'aguardando_adesao_bot'
-            save_data() # Salva o estado para persistência se o bot reiniciar
 
 
         else:
@@ -612,7 +2439,7 @@ async def handle_text_response(update: Update, context: ContextTypes.DEFAULT_TYP
             return
 
     # Lida com o estado de agendamento (apenas para o admin)
-    elif current_state == 'aguardando_horarios_agendamento' and user_chat_id == ADMIN_CHAT_ID:
+    elif current_state == 'aguardando_horarios_agendamento' and dados is not None:
         horarios_input = update.message.text.strip()
         horarios_list = [h.strip() for h in horarios_input.split(',')]
         valid_horarios = []
@@ -626,13 +2453,13 @@ async def handle_text_response(update: Update, context: ContextTypes.DEFAULT_TYP
                 invalid_horarios.append(h)
 
         if valid_horarios:
-            bot_data.setdefault('agendamentos', {})
-            # Garante que ADMIN_CHAT_ID é um int para ser a chave
-            bot_data['agendamentos'][ADMIN_CHAT_ID] = {
+            dados.setdefault('agendamentos', {})
+            # O agendamento padrão do tenant tem como chave o próprio chat do admin (int)
+            dados['agendamentos'][user_chat_id] = {
                 'horarios': valid_horarios,
                 'ativo': True
             }
-            save_data()
+            save_data(user_chat_id)
             context.user_data.pop('estado', None) # Limpa o estado
             
             await update.message.reply_text(
@@ -640,7 +2467,7 @@ async def handle_text_response(update: Update, context: ContextTypes.DEFAULT_TYP
                 f"Horários agendados: {', '.join(valid_horarios)}\n"
                 f"Os posts serão enviados diariamente nesses horários (Fuso: {TIMEZONE.tzname(datetime.datetime.now())})."
             )
-            await agendar_daily_jobs_on_startup(context) # Re-agenda os jobs com os novos horários
+            await reagendar_tenant(context, user_chat_id) # Re-agenda os jobs com os novos horários
         else:
             await update.message.reply_text(
                 "Nenhum horário válido foi fornecido. Por favor, use o formato HH:MM (ex: `09:00, 15:30`).\n"
@@ -649,16 +2476,24 @@ async def handle_text_response(update: Update, context: ContextTypes.DEFAULT_TYP
             )
     
     # Lida com a edição de texto do cabeçalho (apenas para o admin)
-    elif current_state == 'aguardando_texto_cabecalho_fluxo' and user_chat_id == ADMIN_CHAT_ID:
+    elif current_state == 'aguardando_texto_cabecalho_fluxo' and dados is not None:
         new_text = update.message.text
-        bot_data['cabecalho_texto'] = new_text
-        save_data()
+        dados['cabecalho_texto'] = new_text
+        save_data(user_chat_id)
         context.user_data.pop('estado', None)
         await update.message.reply_text(
             f"✅ Texto do cabeçalho atualizado com sucesso!\n\nPreview:\n{new_text}"
             , parse_mode='Markdown'
         )
-        logger.info(f"Texto do cabeçalho atualizado pelo admin {ADMIN_CHAT_ID}.")
+        logger.info(f"Texto do cabeçalho atualizado pelo admin {user_chat_id}.")
+
+    # Lida com a mídia do cabeçalho enviada como link (apenas para o admin)
+    elif current_state == 'aguardando_media_cabecalho_fluxo' and dados is not None:
+        origem = update.message.text.strip()
+        if not origem.startswith(('http://', 'https://')):
+            await update.message.reply_text("Por favor, envie uma foto, GIF, vídeo ou um link (URL) começando com `https://`.", parse_mode='Markdown')
+            return
+        await _aplicar_midia_cabecalho(update.message, context, user_chat_id, dados, origem, None)
 
     # Lida com respostas que não correspondem a nenhum estado conhecido
     else:
@@ -673,8 +2508,9 @@ async def handle_media_response(update: Update, context: ContextTypes.DEFAULT_TY
     """Lida com o recebimento de mídia para o cabeçalho."""
     user_chat_id = update.message.chat_id
     current_state = context.user_data.get('estado')
+    dados = obter_tenant(user_chat_id)
 
-    if current_state == 'aguardando_media_cabecalho_fluxo' and user_chat_id == ADMIN_CHAT_ID:
+    if current_state == 'aguardando_media_cabecalho_fluxo' and dados is not None:
         media_id = None
         media_type = None
 
@@ -689,12 +2525,13 @@ async def handle_media_response(update: Update, context: ContextTypes.DEFAULT_TY
             media_type = 'animation'
         
         if media_id and media_type:
-            bot_data['cabecalho_media_id'] = media_id
-            bot_data['cabecalho_media_type'] = media_type
-            save_data()
+            dados['cabecalho_media_id'] = media_id
+            dados['cabecalho_media_type'] = media_type
+            dados['cabecalho_media_origem'] = None
+            save_data(user_chat_id)
             context.user_data.pop('estado', None)
             await update.message.reply_text(f"✅ Mídia do cabeçalho ({media_type}) atualizada com sucesso!")
-            logger.info(f"Mídia do cabeçalho ({media_type}) atualizada pelo admin {ADMIN_CHAT_ID}.")
+            logger.info(f"Mídia do cabeçalho ({media_type}) atualizada pelo admin {user_chat_id}.")
         else:
             await update.message.reply_text("Por favor, envie uma foto, GIF ou vídeo válido para o cabeçalho. Outros tipos de mídia não são suportados para o cabeçalho.")
     else:
@@ -714,10 +2551,24 @@ async def handle_new_chat_members(update: Update, context: ContextTypes.DEFAULT_
         chat_name = update.message.chat.title
         chat_type = update.message.chat.type # 'group', 'supergroup', 'channel'
 
+        # Define a lista (tenant) em que o chat será cadastrado
+        if MULTI_TENANT:
+            tenant_id = context.user_data.get('tenant_cadastro')
+            if tenant_id is None and update.message.from_user and update.message.from_user.id in tenants:
+                tenant_id = update.message.from_user.id # O próprio admin de um tenant adicionou o bot
+            dados = tenants.get(tenant_id)
+        else:
+            tenant_id = ADMIN_CHAT_ID
+            dados = bot_data
+
         # Verifica se é um grupo ou canal (supergroup)
         if chat_type in ['group', 'supergroup', 'channel']:
+            if dados is None:
+                logger.warning(f"Bot adicionado a {chat_name} ({chat_id_joined}) sem um tenant de destino. Use /cadastrar <id> antes.")
+                return
+
             # Verifique se o bot está no estado 'aguardando_adesao_bot' e se o user_id_cadastro é o admin
-            # Ou, de forma mais geral, se o ADMIN_CHAT_ID está realizando o cadastro
+            # Ou, de forma mais geral, se o admin do tenant está realizando o cadastro
             user_id_requesting_cadastro = context.user_data.get('user_id_cadastro')
             cadastrando_link = context.user_data.get('cadastrando_link')
 
@@ -731,7 +2582,7 @@ async def handle_new_chat_members(update: Update, context: ContextTypes.DEFAULT_
                 logger.error(f"Erro ao obter informações do chat {chat_id_joined}: {e}")
                 # Se não conseguir info, não pode cadastrar
                 await context.bot.send_message(
-                    chat_id=ADMIN_CHAT_ID,
+                    chat_id=tenant_id,
                     text=f"❌ Erro ao tentar obter informações do chat `{chat_name}` (`{chat_id_joined}`). Não foi possível cadastrar."
                     , parse_mode='Markdown'
                 )
@@ -744,7 +2595,7 @@ async def handle_new_chat_members(update: Update, context: ContextTypes.DEFAULT_
                 bot_status = await context.bot.get_chat_member(chat_id_joined, context.bot.id)
                 if not bot_status.can_post_messages: # Verifica a permissão 'post_messages' para canais/grupos
                     await context.bot.send_message(
-                        chat_id=user_id_requesting_cadastro if user_id_requesting_cadastro else ADMIN_CHAT_ID,
+                        chat_id=user_id_requesting_cadastro if user_id_requesting_cadastro else tenant_id,
                         text=f"⚠️ Fui adicionado ao **{chat_name}**, mas não tenho permissão para enviar mensagens. Por favor, me dê essa permissão para que eu possa divulgar o canal/grupo."
                         , parse_mode='Markdown'
                     )
@@ -753,7 +2604,7 @@ async def handle_new_chat_members(update: Update, context: ContextTypes.DEFAULT_
             except Exception as e:
                 logger.error(f"Erro ao verificar permissões do bot no chat {chat_id_joined}: {e}")
                 await context.bot.send_message(
-                    chat_id=user_id_requesting_cadastro if user_id_requesting_cadastro else ADMIN_CHAT_ID,
+                    chat_id=user_id_requesting_cadastro if user_id_requesting_cadastro else tenant_id,
                     text=f"❌ Erro ao verificar minhas permissões no chat `{chat_name}` (`{chat_id_joined}`). Por favor, verifique manualmente se tenho permissão para enviar mensagens."
                     , parse_mode='Markdown'
                 )
@@ -767,26 +2618,27 @@ async def handle_new_chat_members(update: Update, context: ContextTypes.DEFAULT_
             
             if not actual_invite_link:
                 await context.bot.send_message(
-                    chat_id=user_id_requesting_cadastro if user_id_requesting_cadastro else ADMIN_CHAT_ID,
+                    chat_id=user_id_requesting_cadastro if user_id_requesting_cadastro else tenant_id,
                     text=f"❌ Não consegui obter o link de convite para **{chat_name}** (`{chat_id_joined}`). Não foi possível cadastrar. Por favor, certifique-se de que o bot tem permissão para gerenciar links de convite ou que você forneceu um link válido via /cadastrar."
                     , parse_mode='Markdown'
                 )
                 logger.warning(f"Não foi possível obter o link de convite para {chat_name} ({chat_id_joined}).")
                 return
 
-            bot_data.setdefault('canais_e_grupos', {})
-            bot_data['canais_e_grupos'][chat_id_joined] = {
-                'nome': chat_name,
-                'tipo': chat_type,
-                'link': actual_invite_link,
-                'data_cadastro': datetime.datetime.now(TIMEZONE).isoformat() # Data de cadastro no fuso horário
-            }
-            save_data()
+            dados['canais_e_grupos'].adicionar(
+                chat_id_joined,
+                nome=chat_name,
+                tipo=chat_type,
+                link=actual_invite_link,
+                bots=await detectar_bots_membros(chat_id_joined, context) # Bots (shards) que podem enviar para o chat
+            )
+            save_data(tenant_id)
 
             # Limpa o estado após o cadastro bem-sucedido
             context.user_data.pop('estado', None)
             context.user_data.pop('user_id_cadastro', None)
             context.user_data.pop('cadastrando_link', None)
+            context.user_data.pop('tenant_cadastro', None)
 
             response_message = (
                 f"✅ **{chat_name}** foi cadastrado(a) com sucesso!\n"
@@ -804,20 +2656,20 @@ async def handle_new_chat_members(update: Update, context: ContextTypes.DEFAULT_
                 )
             
             # Envia também para o admin, se for diferente do usuário que pediu
-            if ADMIN_CHAT_ID and (not user_id_requesting_cadastro or user_id_requesting_cadastro != ADMIN_CHAT_ID):
+            if tenant_id and (not user_id_requesting_cadastro or user_id_requesting_cadastro != tenant_id):
                 await context.bot.send_message(
-                    chat_id=ADMIN_CHAT_ID,
+                    chat_id=tenant_id,
                     text=f"🔔 **Notificação de Cadastro:**\n" + response_message,
                     parse_mode='Markdown'
                 )
-            logger.info(f"Canal/grupo '{chat_name}' ({chat_id_joined}) cadastrado com sucesso.")
+            logger.info(f"Canal/grupo '{chat_name}' ({chat_id_joined}) cadastrado com sucesso (tenant {tenant_id}).")
 
         else:
             logger.warning(f"Bot adicionado a um chat que não é grupo/supergrupo/canal: {chat_name} ({chat_id_joined}) Tipo: {chat_type}")
-            if ADMIN_CHAT_ID:
+            if tenant_id:
                 try:
                     await context.bot.send_message(
-                        chat_id=ADMIN_CHAT_ID,
+                        chat_id=tenant_id,
                         text=f"⚠️ Fui adicionado a um chat de tipo `{chat_type}` (não é grupo ou canal) `{chat_name}` (`{chat_id_joined}`). Não foi possível cadastrar."
                         , parse_mode='Markdown'
                     )
@@ -829,62 +2681,223 @@ async def handle_left_chat_member(update: Update, context: ContextTypes.DEFAULT_
     # Se o bot foi removido de um grupo/canal
     if update.message.left_chat_member.id == context.bot.id:
         chat_id_left = update.message.chat_id
-        if chat_id_left in bot_data.get('canais_e_grupos', {}):
-            removed_name = bot_data['canais_e_grupos'][chat_id_left]['nome']
-            del bot_data['canais_e_grupos'][chat_id_left]
-            save_data()
-            logger.info(f"Bot foi removido do chat '{removed_name}' ({chat_id_left}). Removido da lista de divulgação.")
-            if ADMIN_CHAT_ID:
+        # O mesmo chat pode estar na lista de vários tenants
+        for tenant_id, dados in (tenants if MULTI_TENANT else {ADMIN_CHAT_ID: bot_data}).items():
+            if chat_id_left not in dados.get('canais_e_grupos', {}):
+                continue
+            removed_name = dados['canais_e_grupos'][chat_id_left].nome
+            del dados['canais_e_grupos'][chat_id_left]
+            save_data(tenant_id)
+            logger.info(f"Bot foi removido do chat '{removed_name}' ({chat_id_left}). Removido da lista de divulgação (tenant {tenant_id}).")
+            if tenant_id:
                 try:
                     await context.bot.send_message(
-                        chat_id=ADMIN_CHAT_ID,
+                        chat_id=tenant_id,
                         text=f"⚠️ **ATENÇÃO:** Fui removido(a) do canal/grupo **'{removed_name}'** (`{chat_id_left}`). Ele(a) foi automaticamente removido(a) da sua lista de divulgação."
                         , parse_mode='Markdown'
                     )
                 except Exception as e:
                     logger.error(f"Erro ao notificar admin sobre saída do chat: {e}")
 
+# --- Busca Inline ---
+RESULTADOS_INLINE = 50 # Máximo de resultados por resposta permitido pelo Telegram
+
+async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Responde a '@bot <texto>' com os canais/grupos do tenant do usuário que casam com o texto."""
+    inline_query = update.inline_query
+    dados = obter_tenant(inline_query.from_user.id) # O chat privado do admin tem o mesmo id do usuário
+    if dados is None or not inline_query.query.strip():
+        await inline_query.answer([], cache_time=60, is_personal=True)
+        return
+
+    inicio = int(inline_query.offset or 0)
+    encontrados = dados['canais_e_grupos'].buscar(inline_query.query, inicio + RESULTADOS_INLINE + 1)
+    resultados = [
+        InlineQueryResultArticle(
+            id=str(chat_id_int),
+            title=canal.nome or f"ID: {chat_id_int}",
+            description=f"{canal.tipo or 'N/A'} · {chat_id_int}" + (f" · {canal.link}" if canal.link else ""),
+            input_message_content=InputTextMessageContent(f"{canal.nome or chat_id_int}\n{canal.link or ''}".strip())
+        )
+        for chat_id_int, canal in encontrados[inicio:inicio + RESULTADOS_INLINE]
+    ]
+    proximo = str(inicio + RESULTADOS_INLINE) if len(encontrados) > inicio + RESULTADOS_INLINE else ""
+    await inline_query.answer(resultados, cache_time=5, is_personal=True, next_offset=proximo)
+
+# --- Encerramento Gracioso ---
+# Em um redeploy (SIGTERM/SIGINT) ou ao perder a liderança, o encerramento, dentro de SHUTDOWN_PRAZO
+# segundos: para o polling e o agendador (lotes que vencerem vão para o checkpoint), deixa o envio em
+# andamento terminar ou, perto do prazo, o interrompe gravando o progresso no checkpoint, grava os
+# dados, para o keep-alive e libera o lease para um standby assumir na hora.
+SHUTDOWN_PRAZO = float(os.getenv('SHUTDOWN_PRAZO', 8)) # Abaixo dos 10s padrão do Docker antes do SIGKILL
+SHUTDOWN_RESERVA = min(3.0, SHUTDOWN_PRAZO / 3) # Tempo reservado para checkpoint, gravação e paradas
+
+encerrando = False # Novos envios não são iniciados
+interrupcao_envio = asyncio.Event() # Os shards param no próximo chat (o progresso vai para o checkpoint)
+sinal_encerramento = asyncio.Event() # Pedido de encerramento (sinal do sistema ou perda da liderança)
+estado_envio_atual = None # ProgressoEnvio do envio em andamento
+
+async def _pausa_envio(segundos: float) -> None:
+    """asyncio.sleep que termina antes se o envio for interrompido."""
+    try:
+        await asyncio.wait_for(interrupcao_envio.wait(), segundos)
+    except asyncio.TimeoutError:
+        pass
+
+def _adiar_envio(job_data: dict) -> None:
+    """Grava no checkpoint um lote agendado que não chegou a começar, para o próximo líder enviá-lo."""
+    if 'lotes' not in job_data:
+        logger.warning("Envio manual ignorado: o bot está encerrando.")
+        return
+    checkpoint = carregar_checkpoint() or {'pendentes': [], 'resultados': {}, 'relatorio': []}
+    ja_pendentes = {tuple(item) for item in checkpoint['pendentes']}
+    checkpoint['pendentes'].extend(
+        [tenant_id, chat_id_int] for tenant_id, chats in job_data['lotes'].items()
+        for chat_id_int in chats if (tenant_id, chat_id_int) not in ja_pendentes
+    )
+    checkpoint['relatorio'] = list(set(checkpoint['relatorio']) | set(job_data.get('relatorio', [])))
+    salvar_checkpoint(checkpoint)
+    logger.info(f"Lote agendado com {sum(map(len, job_data['lotes'].values()))} chats adiado para o próximo líder (checkpoint).")
+
+async def encerrar_graciosamente(application: Application) -> None:
+    """Encerra o bot sem perder envios nem gravações, dentro de SHUTDOWN_PRAZO segundos."""
+    global encerrando
+    limite = time.monotonic() + SHUTDOWN_PRAZO
+
+    def restante(reserva: float = 0.0) -> float:
+        return max(0.0, limite - time.monotonic() - reserva)
+
+    logger.info(f"Encerrando (prazo de {SHUTDOWN_PRAZO:.0f}s)...")
+
+    # 1. Para de aceitar novos disparos: sem updates, sem agendador e sem novos envios
+    encerrando = True
+    parar_agendador()
+    for tarefa in list(tarefas_de_fundo):
+        tarefa.cancel()
+    try:
+        if application.updater and application.updater.running:
+            await asyncio.wait_for(application.updater.stop(), restante(SHUTDOWN_RESERVA))
+    except Exception as e:
+        logger.error(f"Erro ao parar o polling: {e}")
+
+    # 2. Drena o envio em andamento; perto do prazo, interrompe e grava o progresso
+    drenado = True
+    try:
+        await asyncio.wait_for(envio_lock.acquire(), restante(SHUTDOWN_RESERVA))
+    except asyncio.TimeoutError:
+        logger.warning("Envio em andamento não terminou a tempo. Interrompendo e gravando o checkpoint.")
+        interrupcao_envio.set()
+        try:
+            await asyncio.wait_for(envio_lock.acquire(), restante(SHUTDOWN_RESERVA / 2))
+        except asyncio.TimeoutError:
+            drenado = False
+            if estado_envio_atual is not None:
+                estado_envio_atual.gravar() # Último progresso conhecido
+    if drenado:
+        envio_lock.release() # Lotes ainda na fila veem `encerrando` e vão para o checkpoint
+
+    # 3. Grava os dados de todos os tenants
+    if IS_LEADER:
+        save_data(todos=True)
+
+    # 4. Para o aplicativo (jobs e processamento de updates), os shards e o keep-alive
+    try:
+        if application.running:
+            await asyncio.wait_for(application.stop(), restante())
+    except Exception as e:
+        logger.error(f"Erro ao parar o aplicativo: {e}")
+    await encerrar_shards()
+    try:
+        await asyncio.wait_for(asyncio.to_thread(parar_flask), restante())
+    except Exception as e:
+        logger.error(f"Erro ao parar o servidor Flask: {e}")
+
+    # 5. Libera o lease por último: o standby só assume depois que tudo foi gravado
+    liberar_lideranca()
+    logger.info("Encerramento concluído.")
+
 # --- Função Main e Execução do Bot ---
 async def main() -> None:
     """Inicia o bot e o loop de eventos."""
-    load_data() # Carrega os dados antes de iniciar o aplicativo
+    # Inicia o servidor Flask em uma thread separada para o Keep-Alive
+    # Isso deve ser feito ANTES do bot iniciar o polling para evitar conflitos de loop.
+    # Também mantém vivas as réplicas em standby enquanto aguardam a liderança.
+    keep_alive()
+
+    # Só o líder faz polling (o Telegram não aceita dois getUpdates simultâneos com o mesmo token)
+    await aguardar_lideranca()
 
-    application = Application.builder().token(BOT_TOKEN).build()
+    load_data() # Carrega os dados (gravados pelo líder anterior) antes de iniciar o aplicativo
+
+    builder = Application.builder().token(BOT_TOKEN)
+    if PROFILING_ATIVO:
+        builder.request(RequestInstrumentado(connection_pool_size=256)) # Mesmo pool padrão do builder
+    application = builder.build()
 
     # Adiciona os handlers de comandos
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("cadastrar", cadastrar))
-    application.add_handler(CommandHandler("ajuda", ajuda))
-    application.add_handler(CommandHandler("cancelar", cancelar))
-    application.add_handler(CommandHandler("vercanais", ver_canais_e_grupos))
-    application.add_handler(CommandHandler("editarcabecalho", editar_cabecalho))
-    application.add_handler(CommandHandler("agendar", agendar))
-    application.add_handler(CommandHandler("pararagendamento", parar_agendamento))
-    application.add_handler(CommandHandler("retomaragendamento", retomar_agendamento))
-    application.add_handler(CommandHandler("testarenvio", testar_envio))
-    application.add_handler(CommandHandler("removercanal", remover_canal))
+    application.add_handler(CommandHandler("start", instrumentar(start)))
+    application.add_handler(CommandHandler("cadastrar", instrumentar(cadastrar)))
+    application.add_handler(CommandHandler("ajuda", instrumentar(ajuda)))
+    application.add_handler(CommandHandler("cancelar", instrumentar(cancelar)))
+    application.add_handler(CommandHandler("vercanais", instrumentar(ver_canais_e_grupos)))
+    application.add_handler(CommandHandler("editarcabecalho", instrumentar(editar_cabecalho)))
+    application.add_handler(CommandHandler("midiacabecalho", instrumentar(midia_cabecalho)))
+    application.add_handler(CommandHandler("agendar", instrumentar(agendar)))
+    application.add_handler(CommandHandler("pararagendamento", instrumentar(parar_agendamento)))
+    application.add_handler(CommandHandler("retomaragendamento", instrumentar(retomar_agendamento)))
+    application.add_handler(CommandHandler("testarenvio", instrumentar(testar_envio)))
+    application.add_handler(CommandHandler("removercanal", instrumentar(remover_canal)))
+    application.add_handler(CommandHandler("atualizarshards", instrumentar(atualizar_shards)))
+    application.add_handler(CommandHandler("agendarcanal", instrumentar(agendar_canal)))
+    application.add_handler(CommandHandler("buscar", instrumentar(buscar)))
+    application.add_handler(CommandHandler("stats", instrumentar(stats)))
+    application.add_handler(CommandHandler("perfil", instrumentar(perfil)))
 
     # Adiciona handlers para mensagens de texto, mídia, e membros de chat
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_response))
-    application.add_handler(MessageHandler(filters.PHOTO | filters.VIDEO | filters.ANIMATION, handle_media_response))
-    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, handle_new_chat_members))
-    application.add_handler(MessageHandler(filters.StatusUpdate.LEFT_CHAT_MEMBER, handle_left_chat_member))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrumentar(handle_text_response)))
+    application.add_handler(MessageHandler(filters.PHOTO | filters.VIDEO | filters.ANIMATION, instrumentar(handle_media_response)))
+    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, instrumentar(handle_new_chat_members)))
+    application.add_handler(MessageHandler(filters.StatusUpdate.LEFT_CHAT_MEMBER, instrumentar(handle_left_chat_member)))
 
     # Adiciona handler para callbacks de botões inline
-    application.add_handler(CallbackQueryHandler(handle_callback_query))
+    application.add_handler(CallbackQueryHandler(instrumentar(handle_callback_query)))
 
-    # Inicia o servidor Flask em uma thread separada para o Keep-Alive
-    # Isso deve ser feito ANTES do bot iniciar o polling para evitar conflitos de loop.
-    keep_alive()
+    # Adiciona handler para a busca inline (@bot <texto>; requer o modo inline ativado no BotFather)
+    application.add_handler(InlineQueryHandler(instrumentar(handle_inline_query)))
+
+    # Renova o lease periodicamente enquanto esta instância for a líder
+    application.job_queue.run_repeating(instrumentar(renovar_lideranca), interval=LEASE_RENOVACAO, first=LEASE_RENOVACAO, name="lease_job")
 
     # Agenda os jobs diários na inicialização (se ADMIN_CHAT_ID já estiver definido)
     # Isso é agendado para rodar 1 segundo após o aplicativo iniciar
-    application.job_queue.run_once(agendar_daily_jobs_on_startup, 1)
+    application.job_queue.run_once(instrumentar(agendar_daily_jobs_on_startup), 1)
+
+    # Mede o atraso do event loop (apenas com PROFILING_ATIVO)
+    application.job_queue.run_once(iniciar_monitor_lag, 0)
+
+    # Retoma um envio que o líder anterior deixou pela metade (se um lote agendado começar antes,
+    # ele absorve o checkpoint e este job não encontra nada a retomar)
+    if carregar_checkpoint():
+        application.job_queue.run_once(instrumentar(send_daily_posts), 2, data={'retomar': True}, name="resume_post_job")
+
+    # SIGTERM (redeploy) e SIGINT disparam o encerramento gracioso
+    loop = asyncio.get_running_loop()
+    for sinal in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sinal, sinal_encerramento.set)
+        except (NotImplementedError, RuntimeError):
+            pass # Plataforma sem suporte (ex: Windows) ou fora da thread principal
 
     logger.info("Bot iniciando polling...")
-    # Esta é a chamada que o Replit espera e que gerencia o loop de eventos
-    # para o bot.
-    await application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # run_polling gerencia o próprio loop de eventos e não pode ser aguardado dentro de main();
+    # o ciclo de vida é conduzido aqui para que o encerramento seja coordenado.
+    async with application:
+        await application.start()
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        try:
+            await sinal_encerramento.wait()
+        finally:
+            await encerrar_graciosamente(application)
 
 
 # *** REMOVA COMPLETAMENTE O BLOCO if __name__ == "__main__": ***